@@ -0,0 +1,94 @@
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+
+STATNAMES = ['mean_sojourn_time', 'mean_waiting_time', 'mean_service_time',
+             'waiting_proportion', 'blocked_proportion', 'servers_max_usage',
+             'servers_usage', 'mean_queue_length', 'mean_agents_in_system']
+
+
+@lru_cache(maxsize=4096)
+def _mmck(lambda_a, lambda_s, servers_nb, queue_size):
+    c = servers_nb
+    a = lambda_a / lambda_s
+    rho = a / c
+
+    # Loi stationnaire du nombre d'agents à un facteur près, en logarithmes pour les grands K
+    n_max = c + queue_size if queue_size else c
+    n = np.arange(n_max + 1)
+    log_p = np.concatenate(([0.], np.cumsum(np.log(a / np.minimum(n[1:], c)))))
+    p = np.exp(log_p - log_p.max())
+
+    if queue_size:
+        p /= p.sum()
+        p_block = p[-1]
+        p_full = p[c:].sum()
+        length = (n * p).sum()
+        queue_length = ((n - c)[c:] * p[c:]).sum()
+        p_wait = p[c:-1].sum() / (1 - p_block)
+    else:
+        if rho >= 1:
+            raise ValueError(f"Unstable queue with infinite capacity, load {rho:.3g} >= 1")
+        # Queue géométrique de raison rho au-delà de c serveurs occupés (Erlang C)
+        tail = p[c] / (1 - rho)
+        total = p[:c].sum() + tail
+        p_block = 0.
+        p_full = p_wait = tail / total
+        queue_length = p[c] * rho / (1 - rho) ** 2 / total
+        length = queue_length + a
+
+    throughput = lambda_a * (1 - p_block)
+    return (length / throughput, queue_length / throughput, 1 / lambda_s,
+            p_wait, p_block, p_full, throughput / (c * lambda_s), queue_length, length)
+
+
+def mmck(lambda_a, lambda_s, servers_nb=1, queue_size=None):
+    """
+    Statistiques stationnaires exactes d'une file M/M/c/K, avec les noms de QS.timeline.
+
+    Les paramètres sont ceux de QS pour des lois exponentielles : taux d'arrivée lambda_a, taux
+    de service lambda_s de chacun des servers_nb serveurs et queue_size places d'attente (None
+    pour une file infinie, M/M/c et Erlang C). Les résultats sont mis en cache.
+    """
+    values = _mmck(float(lambda_a), float(lambda_s), int(servers_nb), int(queue_size) if queue_size else None)
+    return pd.Series(values, index=STATNAMES, name='theory')
+
+
+def exact_waterfall(lambda_a, lambda_t, lambda_d, nb_servers_test, nb_servers_front=1,
+                    q_test_size=None, q_front_size=None, **_):
+    """
+    Les départs d'une file M/M/c infinie sont poissonniens (Burke) : le front est alors une
+    M/M/c/K exacte. Derrière une file de tests finie, il n'est qu'approché. Une file infinie
+    doit aussi être stable pour avoir un régime stationnaire, et les arrivées homogènes.
+    """
+    if not np.isscalar(lambda_a):
+        return False
+    stable_test = lambda_a < nb_servers_test * lambda_t
+    stable_front = q_front_size or lambda_a < nb_servers_front * lambda_d
+    return not q_test_size and stable_test and bool(stable_front)
+
+
+def waterfall(lambda_a, lambda_t, lambda_d, nb_servers_test, nb_servers_front=1,
+              q_test_size=None, q_front_size=None, **_):
+    """
+    Statistiques théoriques des deux files de Waterfall, mêmes paramètres que Waterfall (size et
+    seed sont ignorés). Le front reçoit le débit de sortie des tests, voir exact_waterfall.
+    """
+    if not np.isscalar(lambda_a):
+        raise ValueError("No stationary theory for non-homogeneous arrivals, lambda_a must be a rate")
+    test = mmck(lambda_a, lambda_t, nb_servers_test, q_test_size)
+    throughput = lambda_a * (1 - test['blocked_proportion'])
+    front = mmck(throughput, lambda_d, nb_servers_front, q_front_size)
+    return pd.DataFrame({'Test Queue': test, 'Front Queue': front})
+
+
+def check(summary, theory):
+    """
+    Confronte le résumé de replication.replicate (intervalles de confiance par statistique) aux
+    valeurs théoriques. Les index de summary et theory doivent correspondre.
+    """
+    checked = summary[['mean', 'ci_low', 'ci_high']].join(theory.rename('theory'), how='inner')
+    checked['within'] = (checked['ci_low'] <= checked['theory']) & (checked['theory'] <= checked['ci_high'])
+    return checked
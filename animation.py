@@ -1,20 +1,93 @@
+import os
+import subprocess
+from collections import deque
+from multiprocessing import Pool
+
 import matplotlib.pyplot as plt
 from matplotlib.animation import FuncAnimation
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
 import numpy as np
+from PIL import Image
 
-def animate_simple_qs(simulation, save=False, fps=10):
-    # Extraction des données nécessaires
-    tops = simulation.tops
-    queue_size = simulation.queue_z
-    srv_nb = simulation.srv_z
-    time_step = 0.1  # Intervalle de temps pour l'animation
 
+def occupancy(tops, times):
+    # Nombre d'agents en file et en service à chaque instant, à partir des temps triés
+    served = ~tops['blocked'].to_numpy()
+    t_arval_queue = np.sort(tops['t_arval_queue'].to_numpy()[served])
+    t_arval_srv = np.sort(tops['t_arval_srv'].to_numpy()[served])
+    t_depart_sys = np.sort(tops['t_depart_sys'].to_numpy()[served])
+
+    departs = np.searchsorted(t_depart_sys, times, side='right')
+    in_system = np.searchsorted(t_arval_queue, times, side='right') - departs
+    in_service = np.searchsorted(t_arval_srv, times, side='right') - departs
+    return in_system - in_service, in_service
+
+
+def curves(process, times):
+    # Points du processus à afficher pour chaque image, à l'indice près
+    return {
+        't': process.index.to_numpy(),
+        'values': {count: process[count].to_numpy() for count in ['ag_in_sys', 'ag_in_queue', 'ag_in_service']},
+        'ix': np.searchsorted(process.index.to_numpy(), times, side='right')
+    }
+
+
+def new_figure(headless, **kwargs):
+    # Hors affichage, la figure est rendue par Agg sans passer par pyplot
+    if headless:
+        fig = Figure(**kwargs)
+        FigureCanvasAgg(fig)
+        return fig
+    return plt.figure(**kwargs)
+
+
+def frame_times(total_time, time_step=0.1, fps=10, duration=None, max_frames=None):
+    """
+    Instants des images : un pas de time_step, ou moins d'images réparties sur tout l'horizon si
+    la durée de la vidéo (en secondes, à fps images par seconde) ou le budget d'images est dépassé.
+    """
+    nb_frames = int(total_time / time_step) + 1
+    budget = min(int(duration * fps) if duration else nb_frames, max_frames or nb_frames)
+    if budget < nb_frames:
+        return np.linspace(0, total_time, max(budget, 2))
+    return np.arange(nb_frames) * time_step
+
+
+def simple_qs_data(simulation, time_step=0.1, fps=10, duration=None, max_frames=None):
     # Génération des timelines pour les courbes
     mm1_bench, _ = simulation.timeline()
-    total_time = tops['t_depart_sys'].max()
+
+    # Une trace sur disque (tracefile.Trace) est lue par paquets sans charger les agents
+    if hasattr(simulation, 'occupancy'):
+        total_time = simulation.t_end
+        times = frame_times(total_time, time_step, fps, duration, max_frames)
+        in_queue, in_service = simulation.occupancy(times)
+    else:
+        tops = simulation.tops
+        total_time = tops['t_depart_sys'].max()
+        times = frame_times(total_time, time_step, fps, duration, max_frames)
+        in_queue, in_service = occupancy(tops, times)
+
+    return {
+        'queue_size': simulation.queue_z,
+        'srv_nb': simulation.srv_z,
+        'total_time': total_time,
+        'nb_frames': len(times),
+        'in_queue': in_queue,
+        'in_service': in_service,
+        'curves': curves(mm1_bench, times),
+        'y_max': mm1_bench['ag_in_sys'].max() + 1
+    }
+
+
+def simple_qs_scene(data, headless=False):
+    queue_size = data['queue_size']
+    srv_nb = data['srv_nb']
 
     # Configuration de la figure et des axes
-    fig, axes = plt.subplots(4, 1, figsize=(12, 16), gridspec_kw={'height_ratios': [2, 1, 1, 1]})
+    fig = new_figure(headless, figsize=(12, 16))
+    axes = fig.subplots(4, 1, gridspec_kw={'height_ratios': [2, 1, 1, 1]})
 
     # Animation principale (file d'attente et serveurs)
     ax_anim = axes[0]
@@ -49,72 +122,102 @@ def animate_simple_qs(simulation, save=False, fps=10):
 
     lines = []
     for i in range(3):
-        axes[i + 1].set_xlim(0, total_time)
-        axes[i + 1].set_ylim(0, mm1_bench['ag_in_sys'].max() + 1)
+        axes[i + 1].set_xlim(0, data['total_time'])
+        axes[i + 1].set_ylim(0, data['y_max'])
         axes[i + 1].set_title(f"Agents in {labels[i]}")
         axes[i + 1].set_ylabel("Count")
         axes[i + 1].set_xlabel("Time")
         line, = axes[i + 1].plot([], [], drawstyle='steps-mid', color=colors[i], lw=2)
         lines.append(line)
 
+    fig.tight_layout()
+
+    t = data['curves']['t']
+    values = data['curves']['values']
+    curve_ix = data['curves']['ix']
+
     # Fonction de mise à jour
     def update(frame):
-        current_time = frame * time_step
 
         # Mise à jour de l'animation principale
-        active_agents = tops[(tops['t_arval_queue'] <= current_time) & (tops['t_depart_sys'] > current_time)]
-        in_queue = active_agents[active_agents['t_arval_srv'] > current_time]
-        for i, circle in enumerate(queue_circles):
-            if i < len(in_queue):
-                circle.set_color('green')
-                circle.fill = True
-            else:
-                circle.set_color('gray')
-                circle.fill = False
-
-        in_service = active_agents[active_agents['t_arval_srv'] <= current_time]
-        for i, circle in enumerate(server_circles):
-            if i < len(in_service):
-                circle.fill = True
-            else:
-                circle.fill = False
+        set_circles(queue_circles, data['in_queue'][frame], queue=True)
+        set_circles(server_circles, data['in_service'][frame])
 
         # Mise à jour des courbes
+        ix = curve_ix[frame]
         for i, count in enumerate(counts):
-            time_values = mm1_bench.index[mm1_bench.index <= current_time]
-            y_values = mm1_bench.loc[mm1_bench.index <= current_time, count]
-            lines[i].set_data(time_values, y_values)
+            lines[i].set_data(t[:ix], values[count][:ix])
 
-    # Création de l'animation
-    frames = int(total_time / time_step) + 1
-    anim = FuncAnimation(fig, update, frames=frames, interval=100)
+        return queue_circles + server_circles + lines
 
-    # Affichage de l'animation
-    plt.tight_layout()
-    plt.show()
+    return fig, update
 
-    if save:
-        anim.save('animation_with_curves.gif', writer='imagemagick', fps=fps)
 
+def set_circles(circles, nb_filled, queue=False):
+    for i, circle in enumerate(circles):
+        if queue:
+            circle.set_color('green' if i < nb_filled else 'gray')
+        circle.set_fill(bool(i < nb_filled))
 
-def animate_waterfall(simulation, save=False, fps=10):
 
-    # Extraction des données nécessaires
+def animate_simple_qs(simulation, save=False, fps=10, workers=None, headless=False, path=None,
+                      duration=None, max_frames=None, writer='ffmpeg'):
+    """
+    Affiche l'animation, et l'exporte avec save ou headless. Le writer 'ffmpeg' écrit la vidéo
+    path (animation_with_curves.gif par défaut). 'pillow' n'écrit pas de vidéo mais un dossier
+    d'images PNG (animation_with_curves_frames par défaut).
+    """
+    data = simple_qs_data(simulation, fps=fps, duration=duration, max_frames=max_frames)
 
-    test_tops = simulation.q_test.tops
-    test_queue_size = simulation.q_test_size
-    test_srv_nb = simulation.nb_servers_test
+    # Sans affichage, l'animation est seulement exportée
+    if not headless:
+        fig, update = simple_qs_scene(data)
+        anim = FuncAnimation(fig, update, frames=data['nb_frames'], interval=1000 / fps, blit=True)
+        plt.show()
 
-    front_tops = simulation.q_front.tops
-    front_queue_size = simulation.q_front_size
-    front_srv_nb = simulation.nb_servers_front
+    if save or headless:
+        path = path or default_path('animation_with_curves', writer)
+        export_frames(simple_qs_scene, data, path, fps=fps, workers=workers, writer=writer)
+
+
+def waterfall_data(simulation, time_step=0.1, fps=10, duration=None, max_frames=None):
 
-    time_step = 0.1  # Intervalle de temps pour l'animation
+    # Extraction des données nécessaires
+    test_tops = simulation.q_test.tops
+    front_tops = simulation.q_front.tops
 
     # Génération des timelines pour les courbes
     timeline = simulation.timeline()
     total_time = max(test_tops['t_depart_sys'].max(), front_tops['t_depart_sys'].max())
 
+    times = frame_times(total_time, time_step, fps, duration, max_frames)
+    test_in_queue, test_in_service = occupancy(test_tops, times)
+    front_in_queue, front_in_service = occupancy(front_tops, times)
+
+    return {
+        'test_queue_size': simulation.q_test_size,
+        'test_srv_nb': simulation.nb_servers_test,
+        'front_queue_size': simulation.q_front_size,
+        'front_srv_nb': simulation.nb_servers_front,
+        'total_time': total_time,
+        'nb_frames': len(times),
+        'test_in_queue': test_in_queue,
+        'test_in_service': test_in_service,
+        'front_in_queue': front_in_queue,
+        'front_in_service': front_in_service,
+        'curves': [curves(timeline[name], times) for name in ['Test Process', 'Front Process', 'Sum Process']],
+        'y_max': [timeline[name]['ag_in_sys'].max() + 1 for name in ['Test Process', 'Front Process', 'Sum Process']]
+    }
+
+
+def waterfall_scene(data, headless=False):
+
+    test_queue_size = data['test_queue_size']
+    test_srv_nb = data['test_srv_nb']
+    front_queue_size = data['front_queue_size']
+    front_srv_nb = data['front_srv_nb']
+    total_time = data['total_time']
+
     # Configuration de la figure et des axes
     rectangles = [
         (0.1, 0.85, 0.8, 0.1),  # Grand rectangle en haut
@@ -130,7 +233,7 @@ def animate_waterfall(simulation, save=False, fps=10):
     ]
 
     # Création de la figure
-    fig = plt.figure(figsize=(8, 12))
+    fig = new_figure(headless, figsize=(8, 12))
 
     # Animation principale (file d'attente et serveurs)
     ax_anim = fig.add_axes(rectangles[0])
@@ -178,22 +281,19 @@ def animate_waterfall(simulation, save=False, fps=10):
         ax_anim.add_patch(circle)
 
     # Courbes dans les sous-graphes
-    counts = ['ag_in_sys', 'ag_in_queue', 'ag_in_service', 'ag_in_sys', 'ag_in_queue', 'ag_in_service']
+    counts = ['ag_in_sys', 'ag_in_queue', 'ag_in_service']
     labels = ['System', 'Queue', 'Service']
     colors = ['gray', 'green', 'red']
 
     lines = []
     for i in range(6):
         line = i // 2
-        side = i % 2 
+        side = i % 2
         ax = fig.add_axes(rectangles[i + 1])
 
         ax.set_xlim(0, total_time)
-        if side == 0:
-            ax.set_ylim(0, timeline['Test Process']['ag_in_sys'].max() + 1)
-        else:
-            ax.set_ylim(0, timeline['Front Process']['ag_in_sys'].max() + 1)
-            
+        ax.set_ylim(0, data['y_max'][side])
+
         ax.set_title(f"Agents in {labels[line]}")
         line, = ax.plot([], [], drawstyle='steps-mid', color=colors[line], lw=2)
         lines.append(line)
@@ -202,77 +302,176 @@ def animate_waterfall(simulation, save=False, fps=10):
     for i in range(3):
         ax = fig.add_axes(rectangles[i + 7])
         ax.set_xlim(0, total_time)
-        ax.set_ylim(0, timeline["Sum Process"]['ag_in_sys'].max() + 1)
+        ax.set_ylim(0, data['y_max'][2])
         ax.set_title(f"Agents in {labels[i]}")
         line, = ax.plot([], [], drawstyle='steps-mid', color=colors[i], lw=2)
         last_lines.append(line)
 
     # Fonction de mise à jour
     def update(frame):
-        current_time = frame * time_step
 
         # Mise à jour de l'animation principale
-        active_agents = test_tops[(test_tops['t_arval_queue'] <= current_time) & (test_tops['t_depart_sys'] > current_time)]
-        in_queue = active_agents[active_agents['t_arval_srv'] > current_time]
-        for i, circle in enumerate(test_queue_circles):
-            if i < len(in_queue):
-                circle.set_color('green')
-                circle.fill = True
-            else:
-                circle.set_color('gray')
-                circle.fill = False
-
-        in_service = active_agents[active_agents['t_arval_srv'] <= current_time]
-        for i, circle in enumerate(test_server_circles):
-            if i < len(in_service):
-                circle.fill = True
-            else:
-                circle.fill = False
-
-        active_agents = front_tops[(front_tops['t_arval_queue'] <= current_time) & (front_tops['t_depart_sys'] > current_time)]
-        in_queue = active_agents[active_agents['t_arval_srv'] > current_time]
-        for i, circle in enumerate(front_queue_circles):
-            if i < len(in_queue):
-                circle.set_color('green')
-                circle.fill = True
-            else:
-                circle.set_color('gray')
-                circle.fill = False
-
-        in_service = active_agents[active_agents['t_arval_srv'] <= current_time]
-        for i, circle in enumerate(front_server_circles):
-            if i < len(in_service):
-                circle.fill = True
-            else:
-                circle.fill = False
-
-        # Mise à jour des courbes
+        set_circles(test_queue_circles, data['test_in_queue'][frame], queue=True)
+        set_circles(test_server_circles, data['test_in_service'][frame])
+        set_circles(front_queue_circles, data['front_in_queue'][frame], queue=True)
+        set_circles(front_server_circles, data['front_in_service'][frame])
+
+        # Mise à jour des courbes, test à gauche et front à droite
+        for side in range(2):
+            t = data['curves'][side]['t']
+            ix = data['curves'][side]['ix'][frame]
+            for line, count in enumerate(counts):
+                lines[line * 2 + side].set_data(t[:ix], data['curves'][side]['values'][count][:ix])
+
+        t = data['curves'][2]['t']
+        ix = data['curves'][2]['ix'][frame]
         for i, count in enumerate(counts):
-            line = i % 3
-            side = i // 3
-            if side == 0:
-                time_values = timeline['Test Process'].index[timeline['Test Process'].index <= current_time]
-                y_values = timeline['Test Process'].loc[timeline['Test Process'].index <= current_time, count]
-                lines[line * 2 + side].set_data(time_values, y_values)
-            else:
-                time_values = timeline['Front Process'].index[timeline['Front Process'].index <= current_time]
-                y_values = timeline['Front Process'].loc[timeline['Front Process'].index <= current_time, count]
-                lines[line * 2 + side].set_data(time_values, y_values)
-
-        for i, count in enumerate(['ag_in_sys', 'ag_in_queue', 'ag_in_service']):
-            time_values = timeline['Sum Process'].index[timeline['Sum Process'].index <= current_time]
-            y_values = timeline['Sum Process'].loc[timeline['Sum Process'].index <= current_time, count]
-            last_lines[i].set_data(time_values, y_values)
-
-        
-
-    # Création de l'animation
-    frames = int(total_time / time_step) + 1
-    anim = FuncAnimation(fig, update, frames=frames, interval=100)
-
-    # Affichage de l'animation
-    plt.tight_layout()
-    plt.show()
-
-    if save:
-        anim.save('animation_waterfall.gif', writer='imagemagick', fps=fps)
+            last_lines[i].set_data(t[:ix], data['curves'][2]['values'][count][:ix])
+
+        return test_queue_circles + test_server_circles + front_queue_circles + front_server_circles + lines + last_lines
+
+    return fig, update
+
+
+def animate_waterfall(simulation, save=False, fps=10, workers=None, headless=False, path=None,
+                      duration=None, max_frames=None, writer='ffmpeg'):
+    """
+    Affiche l'animation, et l'exporte avec save ou headless. Le writer 'ffmpeg' écrit la vidéo
+    path (animation_waterfall.gif par défaut). 'pillow' n'écrit pas de vidéo mais un dossier
+    d'images PNG (animation_waterfall_frames par défaut).
+    """
+    data = waterfall_data(simulation, fps=fps, duration=duration, max_frames=max_frames)
+
+    # Sans affichage, l'animation est seulement exportée
+    if not headless:
+        fig, update = waterfall_scene(data)
+        anim = FuncAnimation(fig, update, frames=data['nb_frames'], interval=1000 / fps, blit=True)
+        plt.show()
+
+    if save or headless:
+        path = path or default_path('animation_waterfall', writer)
+        export_frames(waterfall_scene, data, path, fps=fps, workers=workers, writer=writer)
+
+
+class Renderer():
+    """
+    Rendu Agg hors affichage d'une scène : le fond statique est dessiné une seule fois, puis
+    seuls les artistes animés sont redessinés pour chaque image.
+    """
+
+    def __init__(self, scene, data):
+        self.fig, self.update = scene(data, headless=True)
+        for artist in self.update(0):
+            artist.set_animated(True)
+        self.fig.canvas.draw()
+        self.background = self.fig.canvas.copy_from_bbox(self.fig.bbox)
+
+    def size(self):
+        return self.fig.canvas.get_width_height()
+
+    def __call__(self, frame):
+        canvas = self.fig.canvas
+        canvas.restore_region(self.background)
+        for artist in self.update(frame):
+            self.fig.draw_artist(artist)
+        return bytes(canvas.buffer_rgba())
+
+
+# Scène de chaque processus du pool, construite une seule fois à son démarrage
+renderer = None
+
+
+def init_renderer(scene, data):
+    global renderer
+    renderer = Renderer(scene, data)
+
+
+def render_frames(frames):
+    return [renderer(frame) for frame in frames]
+
+
+class FFmpegWriter():
+    """
+    Encodage des images RGBA brutes par ffmpeg au fil de l'eau, le format suit l'extension.
+    """
+
+    def __init__(self, path, size, fps):
+        width, height = size
+        command = ['ffmpeg', '-y', '-loglevel', 'error',
+                   '-f', 'rawvideo', '-pix_fmt', 'rgba', '-s', f'{width}x{height}', '-r', str(fps), '-i', '-',
+                   '-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2']
+        if not path.endswith('.gif'):
+            command += ['-pix_fmt', 'yuv420p']
+        self.encoder = subprocess.Popen(command + [path], stdin=subprocess.PIPE)
+
+    def write(self, image):
+        self.encoder.stdin.write(image)
+
+    def close(self):
+        self.encoder.stdin.close()
+        if self.encoder.wait():
+            raise RuntimeError(f"ffmpeg exited with code {self.encoder.returncode}")
+
+
+class PillowWriter():
+    """
+    Ecriture des images en PNG numérotés dans le dossier path, sans ffmpeg. Il n'y a pas de
+    vidéo : un chemin avec une extension (.gif, .mp4) est refusé.
+    """
+
+    def __init__(self, path, size, fps):
+        if os.path.splitext(path)[1]:
+            raise ValueError(f"The 'pillow' writer saves PNG frames in a directory, got file path {path!r}")
+        self.path = path
+        self.size = size
+        self.frame = 0
+        os.makedirs(path, exist_ok=True)
+
+    def write(self, image):
+        Image.frombuffer('RGBA', self.size, image, 'raw', 'RGBA', 0, 1).save(
+            os.path.join(self.path, f'frame_{self.frame:06d}.png'))
+        self.frame += 1
+
+    def close(self):
+        pass
+
+
+writers = {'ffmpeg': FFmpegWriter, 'pillow': PillowWriter}
+
+
+def default_path(name, writer):
+    # Une vidéo pour ffmpeg, un dossier d'images pour pillow
+    return f'{name}_frames' if writer == 'pillow' else f'{name}.gif'
+
+
+def export_frames(scene, data, path, fps=10, workers=None, chunk_size=16, writer='ffmpeg'):
+    """
+    Rend les images de l'animation hors affichage et les envoie dans l'ordre au writer : la
+    vidéo path pour 'ffmpeg', le dossier d'images path pour 'pillow'. Avec workers, les images
+    sont rendues par paquets de chunk_size sur un pool de processus, au plus deux paquets par
+    processus en attente : la mémoire ne dépend pas du nombre d'images.
+    """
+    if writer not in writers:
+        raise ValueError(f"Unknown writer {writer!r}, expected one of {list(writers)}")
+    nb_frames = data['nb_frames']
+    main = Renderer(scene, data)
+    output = writers[writer](path, main.size(), fps)
+
+    try:
+        if not workers or workers == 1:
+            for frame in range(nb_frames):
+                output.write(main(frame))
+            return
+
+        with Pool(workers, initializer=init_renderer, initargs=(scene, data)) as pool:
+            pending = deque()
+            for start in range(0, nb_frames, chunk_size):
+                pending.append(pool.apply_async(render_frames, (range(start, min(start + chunk_size, nb_frames)),)))
+                if len(pending) >= 2 * workers:
+                    for image in pending.popleft().get():
+                        output.write(image)
+            while pending:
+                for image in pending.popleft().get():
+                    output.write(image)
+    finally:
+        output.close()
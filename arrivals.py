@@ -0,0 +1,145 @@
+import numpy as np
+
+
+class Arrivals():
+    """
+    Arrivées d'un processus de Poisson non homogène, à passer comme arval_dist à QS, Stream,
+    Tandem ou Waterfall : chaque appel arval_dist(size=n) retourne les n inter-arrivées
+    suivantes, la génération se fait donc par paquets et se poursuit d'un appel à l'autre.
+
+    rng peut être laissé à None et fourni ensuite (Waterfall lui donne le sien).
+    """
+
+    def __init__(self, rng=None):
+        self.rng = rng
+        self.reset()
+
+    def reset(self):
+        # Instant de la dernière arrivée retournée
+        self.t = 0.
+
+    def times(self, size):
+        raise NotImplementedError
+
+    def __call__(self, size=None):
+        times = self.times(1 if size is None else size)
+        t_interarvals = np.diff(times, prepend=self.t)
+        self.t = times[-1]
+        return t_interarvals[0] if size is None else t_interarvals
+
+    def describe(self):
+        """
+        Description stable et hachable du processus, sans son générateur ni sa position, qui
+        identifie par exemple un point de sweep.
+        """
+        raise NotImplementedError
+
+    def state(self):
+        return dict(self.__dict__, rng=None)
+
+    def restore(self, state):
+        self.__dict__.update({key: value for key, value in state.items() if key != 'rng'})
+
+
+class PiecewiseRate(Arrivals):
+    """
+    Taux constant par morceaux : rates[k] arrivées par unité de temps à partir de starts[k]
+    (starts[0] vaut 0). Avec period, la table se répète (pics journaliers), sinon le dernier
+    taux vaut jusqu'à l'infini.
+
+    Les arrivées sont tirées exactement par inversion de l'intensité cumulée : les instants d'un
+    processus de Poisson de taux 1 (somme cumulée d'exponentielles) sont ramenés au temps réel.
+    """
+
+    def __init__(self, starts, rates, period=None, rng=None):
+        self.starts = np.asarray(starts, dtype=float)
+        self.rates = np.asarray(rates, dtype=float)
+        if self.starts[0] != 0 or np.any(np.diff(self.starts) <= 0) or len(self.starts) != len(self.rates):
+            raise ValueError("starts must begin at 0 and increase, with one rate per start")
+        if np.any(self.rates < 0) or not np.any(self.rates > 0) or (period is None and self.rates[-1] <= 0):
+            raise ValueError("Rates must be non-negative, with arrivals that never stop")
+        if period is not None and period <= self.starts[-1]:
+            raise ValueError("period must be larger than the last start")
+
+        # Intensité cumulée au début de chaque morceau, et sur une période entière
+        self.period = period
+        self.cumul = np.concatenate(([0.], np.cumsum(self.rates[:-1] * np.diff(self.starts))))
+        self.cumul_period = self.cumul[-1] + self.rates[-1] * (period - self.starts[-1]) if period else None
+        super().__init__(rng)
+
+    def reset(self):
+        super().reset()
+        # Horloge du processus de taux 1
+        self.s = 0.
+
+    def describe(self):
+        return (type(self).__name__, tuple(self.starts.tolist()), tuple(self.rates.tolist()),
+                None if self.period is None else float(self.period))
+
+    def rate(self, t):
+        t = np.asarray(t, dtype=float)
+        if self.period:
+            t = t % self.period
+        return self.rates[np.searchsorted(self.starts, t, side='right') - 1]
+
+    def times(self, size):
+        s = self.s + np.cumsum(self.rng.exponential(1., size=size))
+        self.s = s[-1]
+
+        # Périodes entières d'abord, puis morceau où tombe le reste : un morceau de taux nul a la
+        # même intensité cumulée que le suivant, side='right' le saute
+        if self.period:
+            cycles = np.floor(s / self.cumul_period)
+            s = s - cycles * self.cumul_period
+        segment = np.searchsorted(self.cumul, s, side='right') - 1
+        t = self.starts[segment] + (s - self.cumul[segment]) / self.rates[segment]
+        return t + cycles * self.period if self.period else t
+
+
+class RateFunction(Arrivals):
+    """
+    Taux quelconque rate(t), vectorisé et majoré par rate_max, tiré par amincissement
+    (Lewis et Shedler) : des candidats de taux rate_max sont gardés avec probabilité
+    rate(t) / rate_max, par blocs, les acceptés en trop servant aux appels suivants.
+    """
+
+    def __init__(self, rate, rate_max, rng=None, block_size=4096):
+        self.rate = rate
+        self.rate_max = rate_max
+        self.block_size = block_size
+        super().__init__(rng)
+
+    def describe(self):
+        # La fonction de taux n'est connue que par son nom, à choisir distinct pour chaque taux
+        name = f"{getattr(self.rate, '__module__', '')}.{getattr(self.rate, '__qualname__', repr(self.rate))}"
+        return (type(self).__name__, name, float(self.rate_max), int(self.block_size))
+
+    def reset(self):
+        super().reset()
+        # Horloge des candidats et arrivées acceptées pas encore retournées
+        self.clock = 0.
+        self.pending = np.empty(0)
+
+    def times(self, size):
+        accepted = [self.pending]
+        count = len(self.pending)
+        while count < size:
+            nb = max(self.block_size, 2 * (size - count))
+            candidates = self.clock + np.cumsum(self.rng.exponential(1. / self.rate_max, size=nb))
+            self.clock = candidates[-1]
+            rates = np.asarray(self.rate(candidates), dtype=float)
+            if np.any(rates > self.rate_max * (1 + 1e-12)):
+                raise ValueError(f"rate exceeds rate_max={self.rate_max} at t={candidates[rates > self.rate_max][0]:g}")
+            kept = candidates[self.rng.random(nb) * self.rate_max < rates]
+            accepted.append(kept)
+            count += len(kept)
+
+        times = np.concatenate(accepted)
+        self.pending = times[size:]
+        return times[:size]
+
+    def state(self):
+        return dict(super().state(), rate=None)
+
+    def restore(self, state):
+        super().restore({key: value for key, value in state.items() if key != 'rate'})
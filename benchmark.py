@@ -0,0 +1,177 @@
+import argparse
+import itertools
+import json
+import platform
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from qs import QS
+from waterfall import Waterfall
+
+
+SIZES = [10**2, 10**3, 10**4, 10**5, 10**6]
+SERVERS = [1, 4]
+QUEUE_SIZES = [None, 10]
+POLICIES = ['fifo', 'lifo', 'sjf']
+
+KEY = ['target', 'size', 'servers', 'queue_size', 'policy', 'phase']
+
+
+def build_qs(size, servers, queue_size, policy, seed=42, load=0.9):
+    """
+    File M/M/c de charge load : arrivées de taux 1, c serveurs de taux load / c.
+    """
+    rng = np.random.default_rng(seed)
+    arval_dist = lambda size: rng.exponential(1., size=size)
+    srv_dist = lambda size=None: rng.exponential(servers * load, size=size)
+    return QS(arval_dist, srv_dist, servers, queue_size, policy=policy, test_size=size)
+
+
+def build_waterfall(size, servers, queue_size, policy, seed=42, load=0.9):
+    """
+    Waterfall de même charge sur les deux files, la politique est toujours FIFO.
+    """
+    return Waterfall(1., 1. / (servers * load), 1. / load, servers, 1, queue_size, queue_size, size=size, seed=seed)
+
+
+def qs_phases(simulation):
+    return [('pretreat', simulation.pretreat), ('run', simulation.run),
+            ('posttreat', simulation.posttreat), ('timeline', simulation.timeline)]
+
+
+def waterfall_phases(simulation):
+    return [('run', simulation.run), ('posttreat', simulation.posttreat), ('timeline', simulation.timeline)]
+
+
+TARGETS = {'qs': (build_qs, qs_phases), 'waterfall': (build_waterfall, waterfall_phases)}
+
+
+def measure(target, size, servers, queue_size, policy, repeat=3, memory=True):
+    """
+    Temps d'exécution de chaque phase (meilleur de repeat passes) et pic mémoire alloué pendant
+    la phase, mesuré sur une passe à part sous tracemalloc pour ne pas fausser les temps.
+    """
+    build, phases = TARGETS[target]
+    walls = {}
+    for _ in range(repeat):
+        simulation = build(size, servers, queue_size, policy)
+        for phase, call in phases(simulation):
+            start = time.perf_counter()
+            call()
+            walls[phase] = min(walls.get(phase, np.inf), time.perf_counter() - start)
+
+    peaks = {}
+    if memory:
+        simulation = build(size, servers, queue_size, policy)
+        tracemalloc.start()
+        for phase, call in phases(simulation):
+            tracemalloc.reset_peak()
+            current = tracemalloc.get_traced_memory()[0]
+            call()
+            peaks[phase] = (tracemalloc.get_traced_memory()[1] - current) / 2**20
+        tracemalloc.stop()
+
+    params = {'target': target, 'size': size, 'servers': servers, 'queue_size': queue_size, 'policy': policy}
+    return [{**params, 'phase': phase, 'wall': walls[phase], 'peak_mb': peaks.get(phase, np.nan)}
+            for phase in walls]
+
+
+def configurations(sizes=SIZES, servers=SERVERS, queue_sizes=QUEUE_SIZES, policies=POLICIES, targets=TARGETS):
+    for target, size, srv, queue_size, policy in itertools.product(targets, sizes, servers, queue_sizes, policies):
+        # Waterfall ne prend pas de politique, une seule configuration suffit
+        if target == 'waterfall' and policy != policies[0]:
+            continue
+        yield {'target': target, 'size': size, 'servers': srv, 'queue_size': queue_size,
+               'policy': policy if target == 'qs' else 'fifo'}
+
+
+def benchmark(repeat=3, memory=True, verbose=False, **grid):
+    """
+    Mesure toutes les configurations de la grille (sizes, servers, queue_sizes, policies,
+    targets), une ligne par configuration et par phase.
+    """
+    rows = []
+    for config in configurations(**grid):
+        measures = measure(**config, repeat=repeat, memory=memory)
+        rows += measures
+        if verbose:
+            print(config, f"{sum(row['wall'] for row in measures):.3f}s", file=sys.stderr)
+    return pd.DataFrame(rows, columns=KEY + ['wall', 'peak_mb'])
+
+
+def save(results, path):
+    """
+    Ecrit les résultats en JSON avec l'environnement de mesure.
+    """
+    payload = {
+        'environment': {'python': platform.python_version(), 'numpy': np.__version__,
+                        'pandas': pd.__version__, 'machine': platform.machine(), 'system': platform.system()},
+        'results': json.loads(results.to_json(orient='records'))
+    }
+    with open(path, 'w') as f:
+        json.dump(payload, f, indent=1)
+
+
+def load(path):
+    with open(path) as f:
+        return pd.DataFrame(json.load(f)['results'], columns=KEY + ['wall', 'peak_mb'])
+
+
+def compare(results, baseline, tolerance=0.25, min_wall=0.005, min_peak_mb=1.):
+    """
+    Compare les mesures à une référence sur les configurations communes.
+
+    Une phase régresse si son temps ou son pic mémoire dépasse la référence de plus de
+    tolerance (en relatif) et de plus de min_wall secondes ou min_peak_mb Mo (en absolu), pour
+    ne pas signaler le bruit des phases très courtes.
+    """
+    # Les files infinies sont à None dans les mesures et à null dans les fichiers
+    def keyed(frame):
+        return frame.assign(queue_size=frame['queue_size'].fillna(0).astype(int))
+
+    merged = keyed(results).merge(keyed(baseline), on=KEY, suffixes=('', '_baseline'))
+
+    merged['wall_ratio'] = merged['wall'] / merged['wall_baseline']
+    merged['peak_ratio'] = merged['peak_mb'] / merged['peak_mb_baseline']
+    slower = (merged['wall_ratio'] > 1 + tolerance) & (merged['wall'] - merged['wall_baseline'] > min_wall)
+    bigger = (merged['peak_ratio'] > 1 + tolerance) & (merged['peak_mb'] - merged['peak_mb_baseline'] > min_peak_mb)
+    merged['regression'] = slower | bigger
+    return merged
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark of QS and Waterfall phases.")
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES)
+    parser.add_argument('--servers', type=int, nargs='+', default=SERVERS)
+    parser.add_argument('--queue-sizes', type=int, nargs='+', default=QUEUE_SIZES,
+                        help="0 stands for an infinite queue")
+    parser.add_argument('--policies', nargs='+', default=POLICIES)
+    parser.add_argument('--targets', nargs='+', default=list(TARGETS), choices=list(TARGETS))
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--no-memory', action='store_true')
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--baseline', help="results file to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    args = parser.parse_args(argv)
+
+    queue_sizes = [queue_size or None for queue_size in args.queue_sizes]
+    results = benchmark(repeat=args.repeat, memory=not args.no_memory, verbose=True,
+                        sizes=args.sizes, servers=args.servers, queue_sizes=queue_sizes,
+                        policies=args.policies, targets=args.targets)
+    save(results, args.output)
+
+    if args.baseline:
+        comparison = compare(results, load(args.baseline), tolerance=args.tolerance)
+        regressions = comparison[comparison['regression']]
+        print(regressions[KEY + ['wall', 'wall_baseline', 'peak_mb', 'peak_mb_baseline']].to_string()
+              if len(regressions) else "No regression")
+        return 1 if len(regressions) else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,53 @@
+import os
+import pickle
+import zlib
+
+import numpy as np
+
+
+VERSION = 1
+
+
+def generators(*dists):
+    """
+    Générateurs numpy utilisés par des distributions : méthode liée d'un Generator
+    (rng.exponential), fonction qui en capture un (lambda size: rng.exponential(...)) ou
+    objet qui le garde dans rng (arrivals.Arrivals).
+    """
+    found = []
+    for dist in dists:
+        candidates = [getattr(dist, '__self__', None), getattr(dist, 'rng', None)]
+        candidates += [cell.cell_contents for cell in getattr(dist, '__closure__', None) or ()]
+        for candidate in candidates:
+            if isinstance(candidate, np.random.Generator) and all(candidate is not rng for rng in found):
+                found.append(candidate)
+    return found
+
+
+def save(path, state, rngs):
+    """
+    Ecrit l'état et celui des générateurs dans un fichier compressé, remplacé d'un coup pour
+    qu'une interruption ne laisse jamais de point de reprise partiel.
+    """
+    payload = {'version': VERSION, 'rngs': [rng.bit_generator.state for rng in rngs], 'state': state}
+    tmp = f'{path}.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(zlib.compress(pickle.dumps(payload, protocol=pickle.HIGHEST_PROTOCOL)))
+    os.replace(tmp, path)
+
+
+def load(path, rngs=None):
+    """
+    Lit un point de reprise et remet les générateurs rngs dans leur état enregistré.
+    """
+    with open(path, 'rb') as f:
+        payload = pickle.loads(zlib.decompress(f.read()))
+    if payload['version'] != VERSION:
+        raise ValueError(f"Unsupported checkpoint version {payload['version']}, expected {VERSION}")
+
+    if rngs is not None:
+        if len(rngs) != len(payload['rngs']):
+            raise ValueError(f"Checkpoint holds {len(payload['rngs'])} generators, got {len(rngs)}")
+        for rng, rng_state in zip(rngs, payload['rngs']):
+            rng.bit_generator.state = rng_state
+    return payload['state']
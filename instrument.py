@@ -0,0 +1,137 @@
+import cProfile
+import io
+import pstats
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+
+def max_overlap(starts, ends):
+    """
+    Nombre maximal d'intervalles [start, end) ouverts en même temps, une fin à l'instant d'un
+    début est comptée avant lui.
+    """
+    if len(starts) == 0:
+        return 0
+    t_events = np.concatenate((ends, starts))
+    steps = np.concatenate((-np.ones(len(ends), dtype=np.int64), np.ones(len(starts), dtype=np.int64)))
+    order = np.lexsort((steps, t_events))
+    return int(np.cumsum(steps[order]).max())
+
+
+class Probe():
+    """
+    Instrumentation d'une simulation : durées par phase, compteurs d'évènements et maxima
+    atteints (longueur de file, serveurs occupés), avec capture cProfile et tracemalloc en option.
+
+    Désactivée (enabled=False), chaque point de mesure se réduit à un test : les boucles des
+    moteurs ne sont instrumentées qu'en remplaçant leurs appels par des versions chronométrées.
+    Les sondes obtenues par scope partagent les mesures sous un préfixe.
+    """
+
+    def __init__(self, enabled=True, profile=False, memory=False):
+        self.enabled = enabled
+        self.profile = profile
+        self.memory = memory
+        self.prefix = ''
+
+        # Mesures partagées avec les sondes filles
+        self.timers = {}
+        self.counters = {}
+        self.high = {}
+        self.captures = {'profile': None, 'peak_memory_mb': None}
+
+    def __bool__(self):
+        return self.enabled
+
+    def scope(self, name):
+        child = Probe.__new__(Probe)
+        child.__dict__.update(self.__dict__)
+        child.prefix = f'{self.prefix}{name}.'
+        return child
+
+    def add_time(self, name, seconds, calls=1):
+        timer = self.timers.setdefault(self.prefix + name, [0., 0])
+        timer[0] += seconds
+        timer[1] += calls
+
+    def count(self, name, n=1):
+        if self.enabled:
+            name = self.prefix + name
+            self.counters[name] = self.counters.get(name, 0) + int(n)
+
+    def high_water(self, name, value):
+        if self.enabled:
+            name = self.prefix + name
+            self.high[name] = max(self.high.get(name, value), value)
+
+    @contextmanager
+    def phase(self, name):
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def timed(self, name, func):
+        """
+        Version chronométrée de func, à n'utiliser que si la sonde est active.
+        """
+        add_time = self.add_time
+        perf_counter = time.perf_counter
+
+        def wrapper(*args, **kwargs):
+            start = perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                add_time(name, perf_counter() - start)
+
+        return wrapper
+
+    @contextmanager
+    def capture(self):
+        """
+        Exécute le bloc sous cProfile et tracemalloc si profile et memory sont demandés.
+        """
+        profiler = cProfile.Profile() if self.enabled and self.profile else None
+        traced = self.enabled and self.memory and not tracemalloc.is_tracing()
+        if traced:
+            tracemalloc.start()
+        if profiler:
+            profiler.enable()
+        try:
+            yield self
+        finally:
+            if profiler:
+                profiler.disable()
+                out = io.StringIO()
+                pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(25)
+                self.captures['profile'] = out.getvalue()
+            if traced:
+                self.captures['peak_memory_mb'] = tracemalloc.get_traced_memory()[1] / 2**20
+                tracemalloc.stop()
+
+    def report(self):
+        """
+        Mesures structurées : durées (total, appels, moyenne), compteurs, maxima et captures.
+        """
+        timers = pd.DataFrame([(name, total, calls) for name, (total, calls) in self.timers.items()],
+                              columns=['phase', 'total', 'calls']).set_index('phase')
+        timers['mean'] = timers['total'] / timers['calls']
+        return {
+            'timers': timers,
+            'counters': pd.Series(self.counters, dtype='int64'),
+            'high_water': pd.Series(self.high, dtype='int64'),
+            **self.captures
+        }
+
+
+# Sonde par défaut des simulations, sans aucune mesure
+disabled = Probe(enabled=False)
@@ -1,17 +1,100 @@
+import heapq
+import inspect
+from collections import deque
+
 import numpy as np
 import pandas as pd
 
-class Wline():
+import checkpoint
+from arrivals import Arrivals
+from instrument import disabled, max_overlap
+from steady import mser
+from stream import Stream
+from tracefile import TraceWriter
 
-    def __init__(self, size=None, policy=(lambda x: 0)):
-        self.size = size
-        self.next = policy
+def fifo(queue):
+    return 0
+
+def accepts_size(dist):
+    #Tells whether a distribution can draw a batch of values through size=
+    try:
+        return 'size' in inspect.signature(dist).parameters
+    except (TypeError, ValueError):
+        return False
+
+class Sampler():
+    
+    def __init__(self, dist, block_size=4096):
+        #Either a distribution, drawn by blocks when it accepts size=, or an empirical trace of values
+        self.dist = dist
+        self.trace = not callable(dist)
+        self.block_size = block_size
+        self.block = list(np.asarray(dist, dtype=float)) if self.trace else []
+        self.ix = 0
         
-    def populate(self, queue):
-        self.queue = queue
+    def refill(self, size):
+        if self.trace:
+            raise ValueError(f"Empirical trace exhausted after {len(self.block)} values")
+        if accepts_size(self.dist):
+            self.block = np.asarray(self.dist(size=size), dtype=float).tolist()
+        else:
+            self.block = [self.dist() for _ in range(size)]
+        self.ix = 0
+        
+    def __call__(self):
+        if self.ix == len(self.block):
+            self.refill(self.block_size)
+        value = self.block[self.ix]
+        self.ix += 1
+        return value
+    
+    def state(self):
+        #Values drawn but not used yet, they come after the generator state
+        return self.block[self.ix:]
+    
+    def restore(self, block):
+        self.block = list(block)
+        self.ix = 0
+    
+    def draw(self, size):
+        #Values left in the current block come first, the rest is drawn in one go
+        values = self.block[self.ix:self.ix + size]
+        self.ix += len(values)
+        if len(values) < size:
+            self.refill(size - len(values))
+            values += self.block
+            self.ix = len(self.block)
+        return np.asarray(values, dtype=float)
+    
+def tops_columns(size):
+    #Typed columns, times stay NaN and server -1 for agents that are not served
+    return {'t_arval_queue': np.full(size, np.nan),
+            't_arval_srv': np.full(size, np.nan),
+            't_depart_sys': np.full(size, np.nan),
+            'blocked': np.zeros(size, dtype=bool),
+            'server': np.full(size, -1, dtype=np.int32)}
+
+def tops_frame(columns):
+    #The frame wraps the column arrays without copying them
+    return pd.DataFrame(columns, copy=False)
+
+class Indexed():
     
+    def __init__(self, policy=None):
+        #Any callable returning the index of the next agent in the waiting list
+        self.policy = policy
+        
+    def reset(self):
+        self.queue = []
+        
+    def push(self, agent, key=None):
+        self.queue.append(agent)
+        
     def pop(self):
-        pop_ix = self.next(self.queue)
+        if not self.queue:
+            return None
+        
+        pop_ix = self.policy(self.queue)
         pop_val = None
         
         if -1 < pop_ix < len(self.queue):
@@ -20,13 +103,126 @@ class Wline():
             
         return pop_val
     
+    def __len__(self):
+        return len(self.queue)
+    
+    def state(self):
+        #Waiting agents only, the policy is given again when rebuilding the simulation
+        return {key: value for key, value in self.__dict__.items() if not callable(value)}
+    
+    def restore(self, state):
+        self.__dict__.update(state)
+    
+class Fifo(Indexed):
+    
+    def reset(self):
+        self.queue = deque()
+        
+    def pop(self):
+        return self.queue.popleft() if self.queue else None
+    
+class Lifo(Indexed):
+    
+    def pop(self):
+        return self.queue.pop() if self.queue else None
+    
+class Priority(Indexed):
+    
+    def __init__(self, classes):
+        #classes maps an agent to its priority class, lower classes are served first
+        self.classes = classes
+        
+    def reset(self):
+        #One FIFO line per class, and a heap of classes with waiting agents
+        self.queue = {}
+        self.active = []
+        self.count = 0
+        
+    def push(self, agent, key=None):
+        prio = self.classes(agent)
+        line = self.queue.get(prio)
+        if line is None:
+            line = self.queue[prio] = deque()
+        if not line:
+            heapq.heappush(self.active, prio)
+        line.append(agent)
+        self.count += 1
+        
+    def pop(self):
+        if not self.active:
+            return None
+        line = self.queue[self.active[0]]
+        agent = line.popleft()
+        if not line:
+            heapq.heappop(self.active)
+        self.count -= 1
+        return agent
+    
+    def __len__(self):
+        return self.count
+    
+class Sjf(Indexed):
+    
+    def push(self, agent, key=None):
+        #key is the service time of the agent, ties are broken by arrival order
+        heapq.heappush(self.queue, (key, agent))
+        
+    def pop(self):
+        return heapq.heappop(self.queue)[1] if self.queue else None
+    
+class Wline():
+
+    def __init__(self, size=None, policy=fifo):
+        self.size = size
+        self.next = policy
+        
+        #Built-in disciplines pop in O(1) or O(log n), other callables go through Indexed
+        if policy is fifo or policy == 'fifo':
+            self.discipline = Fifo()
+        elif policy == 'lifo':
+            self.discipline = Lifo()
+        elif policy == 'sjf':
+            self.discipline = Sjf()
+        elif isinstance(policy, Indexed):
+            self.discipline = policy
+        else:
+            self.discipline = Indexed(policy)
+        
+        #Shortest job first needs service times as soon as agents wait
+        self.by_service = isinstance(self.discipline, Sjf)
+        self.populate([])
+        
+    def populate(self, queue):
+        self.discipline.reset()
+        self.queue = self.discipline.queue
+        for agent in queue:
+            self.push(agent)
+            
+    def push(self, agent, key=None):
+        self.discipline.push(agent, key)
+    
+    def pop(self):
+        return self.discipline.pop()
+    
+    def restore(self, state):
+        self.discipline.restore(state)
+        self.queue = self.discipline.queue
+    
+    def __len__(self):
+        return len(self.discipline)
+    
 
 class InService():
     
-    def __init__(self, nb=1, dist=None):
+    def __init__(self, nb=1, dist=None, probe=disabled):
         self.nb = nb
         self.server = [None]*nb
-        self.dist = dist
+        self.dist = Sampler(dist)
+        
+        #Instrumented runs time the service draws and the search of the next free server
+        if probe:
+            self.dist.refill = probe.timed('draw', self.dist.refill)
+            self.leaving = probe.timed('leaving', self.leaving)
         
     def full(self):
         return not (None in self.server)
@@ -40,131 +236,439 @@ class InService():
             srv_ix = self.server.index(None) 
         
         else:
-            #Find agent of smallest departure time, needs to be float to use idxmin
-            agent_id = tops.loc[self.server, 't_depart_sys'].astype(float).idxmin()
+            #Find agent of smallest departure time
+            agent_id = tops.loc[self.server, 't_depart_sys'].idxmin()
             #Extract server number of departing agent
             srv_ix = self.server.index(agent_id) 
         
         return srv_ix, agent_id
     
+class Capacity():
+    
+    def __init__(self, size):
+        self.size = size
+        self.departures = []
+        
+    def admit(self, t_depart):
+        heapq.heappush(self.departures, t_depart)
+        
+    def in_system(self, t):
+        #Departure times are popped once passed, arrivals are expected in increasing order
+        while self.departures and self.departures[0] <= t:
+            heapq.heappop(self.departures)
+        return len(self.departures)
+    
+    def full(self, t):
+        return self.in_system(t) >= self.size
+    
 class QS():
     
     def __init__(self, arval_dist, srv_dist, servers_nb, 
-                 queue_size=None, policy=lambda x:0, test_size=100) :
+                 queue_size=None, policy=fifo, test_size=100, engine='auto',
+                 chunk_size=10000, trace_every=None, probe=None, trace_path=None) :
          
+        if engine not in ('auto', 'lindley', 'array', 'loop', 'stream'):
+            raise ValueError(f"Unknown engine '{engine}', expected 'auto', 'lindley', 'array', 'loop' or 'stream'")
+        
+        #Single server FIFO queues with infinite waiting line follow Lindley's recursion
+        lindley = servers_nb == 1 and (policy is fifo or policy == 'fifo') and not queue_size
+        if engine == 'lindley' and not lindley:
+            raise ValueError("Engine 'lindley' needs a single server, a FIFO policy and an infinite queue")
+        if engine == 'auto':
+            engine = 'lindley' if lindley else 'array'
+        if engine == 'loop' and policy == 'sjf':
+            raise ValueError("Engine 'loop' does not support the 'sjf' policy")
+
         #Initializing metadata
         self.arval_dist = arval_dist
         self.srv_dist = srv_dist
         self.srv_z = servers_nb
         self.queue_z = queue_size if queue_size else test_size
         self.test_z = test_size
+        self.engine = engine
+        self.probe = probe or disabled
+        
+        #Agent times and occupancy process are written to disk when a trace path is given
+        self.trace_path = trace_path
 
         #Initializing Waiting Line
         self.wline = Wline(size=queue_size, policy=policy)
         
         #Initializing In Service List
-        self.inservice = InService(nb=servers_nb, dist=srv_dist)
+        self.inservice = InService(nb=servers_nb, dist=srv_dist, probe=self.probe.scope('inservice'))
+        
+        #Initializing system capacity tracker, streaming runs for an unbounded number of arrivals
+        #so its infinite queue never blocks, the other engines bound it with test_size
+        if engine == 'stream' and not queue_size:
+            self.capacity = Capacity(size=np.inf)
+        else:
+            self.capacity = Capacity(size=self.queue_z + servers_nb)
+        
+        #Streaming keeps running aggregates and a sampled trace instead of one row per agent
+        if engine == 'stream':
+            self.stream = Stream(arval_dist, self.wline, self.inservice, self.capacity,
+                                 chunk_size=chunk_size, trace_every=trace_every, probe=self.probe,
+                                 writer=TraceWriter(trace_path, servers_nb, self.queue_z) if trace_path else None)
+            self.tops = self.stream.tops()
+            return
         
         #Initializin tops dataframe
-        column_names = ['t_arval_queue', 't_arval_srv', 't_depart_sys']
-        self.tops = pd.DataFrame(np.empty((test_size, 3),dtype=object), columns=column_names)
+        self.tops = tops_frame(tops_columns(test_size))
         
     def pretreat(self):
         
+        #Arrivals are drawn chunk by chunk while streaming
+        if self.engine == 'stream':
+            return
+        
         #Easing naming
         tops = self.tops
 
-        t_interarvals = self.arval_dist(size=(self.test_z))
-        tops.loc[0, 't_arval_queue'] = t_interarvals[0]
-                
-        for agent in range(1, self.test_z) :
-            tops.loc[agent, 't_arval_queue'] = tops.loc[agent - 1, 't_arval_queue'] + t_interarvals[agent]
+        #Arrival times are the running sum of interarrival times, time-varying arrivals restart
+        #at t=0 like tops so that each run follows the rate table from its beginning
+        with self.probe.phase('pretreat'):
+            if isinstance(self.arval_dist, Arrivals):
+                self.arval_dist.reset()
+            t_interarvals = self.arval_dist(size=(self.test_z))
+            tops['t_arval_queue'] = np.cumsum(t_interarvals)
         
     def run(self):
         
+        with self.probe.phase('run'):
+            if self.engine == 'stream':
+                #Each call carries on with test_size more arrivals
+                self.stream.run(self.test_z)
+                self.tops = self.stream.tops()
+            elif self.engine == 'lindley':
+                self._run_lindley()
+            elif self.engine == 'array':
+                self._run_array()
+            else:
+                self._run_loop()
+        
+        #Streaming writes each chunk as it goes, other engines write their tops once done
+        if self.trace_path and self.engine != 'stream':
+            with self.probe.phase('trace'):
+                writer = TraceWriter(self.trace_path, self.srv_z, self.queue_z)
+                writer.write_tops(self.tops)
+                writer.commit()
+        
+        if self.probe:
+            self._probe_run()
+        
+    def _probe_run(self):
+        
+        #Counters and high-water marks are taken from the run results, not inside the loops
+        #Streaming keeps no results, it counts by chunk instead
+        if self.engine == 'stream':
+            return
+        
+        probe = self.probe
+        tops = self.tops
+        served = ~tops['blocked'].to_numpy()
+        t_arval_queue = tops['t_arval_queue'].to_numpy()[served]
+        t_arval_srv = tops['t_arval_srv'].to_numpy()[served]
+        t_depart_sys = tops['t_depart_sys'].to_numpy()[served]
+        
+        probe.count('arrivals', self.test_z)
+        probe.count('blocked', self.test_z - served.sum())
+        probe.count('waited', (t_arval_srv > t_arval_queue).sum())
+        probe.count('served', served.sum())
+        probe.high_water('queue', max_overlap(t_arval_queue, t_arval_srv))
+        probe.high_water('in_service', max_overlap(t_arval_srv, t_depart_sys))
+        probe.high_water('in_system', max_overlap(t_arval_queue, t_depart_sys))
+        
+    def _run_lindley(self):
+        
+        #Easing naming
+        dist = self.inservice.dist
+        n = self.test_z
+        
+        #Agents are served by order of arrival
+        t_arval_queue = self.tops['t_arval_queue'].to_numpy(dtype=float)
+        order = np.argsort(t_arval_queue, kind='stable')
+        t_arvals = t_arval_queue[order]
+        t_services = dist.draw(n)
+        
+        #Departures unrolled from d_n = max(a_n, d_n-1) + s_n, as d_n = c_n + max_k<=n (a_k - c_k-1)
+        t_cumul = np.cumsum(t_services)
+        t_departs = t_cumul + np.maximum.accumulate(t_arvals - (t_cumul - t_services))
+        
+        #Service starts when both the agent and the previous departure are there, departures are
+        #kept as computed so that a service never starts before the previous one ended
+        t_starts = np.maximum(t_arvals, np.concatenate(([0.], t_departs[:-1])))
+        
+        columns = tops_columns(n)
+        columns['t_arval_queue'] = t_arval_queue
+        columns['t_arval_srv'][order] = t_starts
+        columns['t_depart_sys'][order] = t_departs
+        columns['server'][:] = 0
+        
+        self.inservice.server = [int(order[-1])]
+        self.tops = tops_frame(columns)
+        
+    def _run_array(self):
+        
         #Easing naming
         wline = self.wline
         inservice = self.inservice
+        dist = inservice.dist
+        pop = wline.pop
+        probe = self.probe
+        if probe:
+            pop = probe.timed('wline.pop', pop)
+        
+        #Times are kept in float arrays, tops is only rebuilt once at the end
+        columns = tops_columns(self.test_z)
+        columns['t_arval_queue'] = t_arval_queue = self.tops['t_arval_queue'].to_numpy(dtype=float)
+        t_arval_srv = columns['t_arval_srv']
+        t_depart_sys = columns['t_depart_sys']
+        blocked = columns['blocked']
+        server = columns['server']
+        capacity = self.capacity.size
+        
+        #Busy servers as a min-heap of (departure time, server), idle ones keyed by last departure
+        busy = []
+        idle = [(0., srv_ix) for srv_ix in range(inservice.nb)]
+        last_agent = [None]*inservice.nb
+        services = {}
+        wline.populate([])
+        
+        def start(agent, t, srv_ix):
+            t_dept = t + (services.pop(agent) if agent in services else dist())
+            t_arval_srv[agent] = t
+            t_depart_sys[agent] = t_dept
+            server[agent] = srv_ix
+            last_agent[srv_ix] = agent
+            heapq.heappush(busy, (t_dept, srv_ix))
+        
+        def release(t_limit):
+            #Process departures up to t_limit, a freed server takes the next agent in waiting line
+            while busy and busy[0][0] <= t_limit:
+                t_dept, srv_ix = heapq.heappop(busy)
+                _next = pop()
+                if _next is not None:
+                    start(_next, t_dept, srv_ix)
+                else:
+                    heapq.heappush(idle, (t_dept, srv_ix))
+        
+        #Agents are admitted by order of arrival
+        order = np.argsort(t_arval_queue, kind='stable')
+        for agent, t in zip(order.tolist(), t_arval_queue[order].tolist()):
+            release(t)
+            
+            if len(busy) + len(wline) >= capacity:
+                blocked[agent] = True
+            elif idle:
+                start(agent, t, heapq.heappop(idle)[1])
+            elif wline.by_service:
+                services[agent] = dist()
+                wline.push(agent, services[agent])
+            else:
+                wline.push(agent)
+        
+        #Serve remaining agents of the waiting line
+        release(np.inf)
+        
+        inservice.server = last_agent
+        with probe.phase('frame'):
+            self.tops = tops_frame(columns)
+        
+    def _serve(self, _next):
+        
+        #Easing naming
+        inservice = self.inservice
+        tops = self.tops
+        
+        #Update server arrival time as if no waiting was needed
+        tops.loc[_next, 't_arval_srv'] = tops.loc[_next, 't_arval_queue']
+        
+        #Find next available server
+        srv_ix, dept_ag = inservice.leaving(tops)
+
+        #Fill available server with corresponding next agent in waiting line
+        inservice.server[srv_ix] = _next 
+        tops.loc[_next, 'server'] = srv_ix
+            
+        if dept_ag is not None :
+            if tops.loc[_next, 't_arval_queue'] < tops.loc[dept_ag, 't_depart_sys'] : 
+                #Update server arrival time in case arrival is before system departure
+                tops.loc[_next, 't_arval_srv'] = tops.loc[dept_ag, 't_depart_sys']
+                
+        #Update system departure time
+        tops.loc[_next, 't_depart_sys'] = tops.loc[_next, 't_arval_srv'] + inservice.dist() 
+        self.capacity.admit(tops.loc[_next, 't_depart_sys'])
+        
+    def _run_loop(self):
+        
+        #Easing naming
+        wline = self.wline
+        capacity = self.capacity
         tops = self.tops
+        pop = wline.pop
+        serve = self._serve
+        full = capacity.full
+        
+        #Instrumented runs time the waiting line, the frame writes of each service and the blocking check
+        if self.probe:
+            pop = self.probe.timed('wline.pop', pop)
+            serve = self.probe.timed('serve', serve)
+            full = self.probe.timed('blocking', full)
         
         #Initializing arrival queue
-        wline.queue = list(tops.loc[0:0].index)
+        wline.populate(list(tops.loc[0:0].index))
+        capacity.departures = []
         #Initializing upcomgin theoretical arrival        
         buffer_ix = 1 
     
         while buffer_ix < self.test_z:
             
-            _next = wline.pop()
+            _next = pop()
             if _next is not None: #Waiting line is not empty 
-
-                #Update server arrival time as if no waiting was needed
-                tops.loc[_next, 't_arval_srv'] = tops.loc[_next, 't_arval_queue']
-                
-                #Find next available server
-                srv_ix, dept_ag = inservice.leaving(tops)
-    
-                #Fill available server with corresponding next agent in waiting line
-                inservice.server[srv_ix] = _next 
-                    
-                if dept_ag is not None :
-                    if tops.loc[_next, 't_arval_queue'] < tops.loc[dept_ag, 't_depart_sys'] : 
-                        #Update server arrival time in case arrival is before system departure
-                        tops.loc[_next, 't_arval_srv'] = tops.loc[dept_ag, 't_depart_sys']
-                        
-                #Update system departure time
-                tops.loc[_next, 't_depart_sys'] = tops.loc[_next, 't_arval_srv'] + inservice.dist() 
+                serve(_next)
                                             
-            #Counting prior agents still in system
-            in_system = (tops.loc[0:buffer_ix - 1, 't_depart_sys'] > tops.loc[buffer_ix, 't_arval_queue']).sum()
-                            
-            if self.queue_z is not None and in_system >= self.queue_z + self.inservice.nb:
-                tops.loc[buffer_ix, 't_depart_sys'] = -1
+            #Prior agents still in system are tracked by their departure times
+            if full(tops.loc[buffer_ix, 't_arval_queue']):
+                tops.loc[buffer_ix, 'blocked'] = True
             else:
-                wline.queue.append(buffer_ix)
+                wline.push(buffer_ix)
                     
             buffer_ix += 1
+        
+        #Serve remaining agents of the waiting line
+        _next = pop()
+        while _next is not None:
+            serve(_next)
+            _next = pop()
                 
+    def extend(self, nb_agents):
+        """
+        Poursuit une simulation 'stream' sur nb_agents arrivées de plus, sans refaire les précédentes.
+        """
+        if self.engine != 'stream':
+            raise ValueError("Only the 'stream' engine can be extended, other engines drain their queue at the end of run")
+        with self.probe.phase('run'):
+            self.stream.run(nb_agents)
+            self.tops = self.stream.tops()
+        
+    def checkpoint(self, path, rngs=None):
+        """
+        Enregistre l'état d'une simulation 'stream' : générateurs, serveurs occupés, file
+        d'attente, agrégats et trace. rngs sont les générateurs des distributions, retrouvés
+        dans arval_dist et srv_dist par défaut.
+        """
+        if self.engine != 'stream':
+            raise ValueError("Only the 'stream' engine can be checkpointed")
+        if rngs is None:
+            rngs = checkpoint.generators(self.arval_dist, self.srv_dist)
+        state = {'srv_z': self.srv_z, 'queue_size': self.wline.size, 'stream': self.stream.state()}
+        checkpoint.save(path, state, rngs)
+        
+    def resume(self, path, rngs=None, reseed=False, reset_stats=False):
+        """
+        Reprend l'état enregistré par checkpoint dans une simulation construite avec les mêmes
+        paramètres. Avec reseed, les générateurs gardent leur état actuel : plusieurs suites
+        indépendantes peuvent partir d'un même état chauffé. Avec reset_stats, les agrégats
+        repartent de zéro à l'instant de reprise.
+        """
+        if self.engine != 'stream':
+            raise ValueError("Only the 'stream' engine can be resumed")
+        if rngs is None:
+            rngs = checkpoint.generators(self.arval_dist, self.srv_dist)
+        state = checkpoint.load(path, None if reseed else rngs)
+        if (state['srv_z'], state['queue_size']) != (self.srv_z, self.wline.size):
+            raise ValueError(f"Checkpoint has {state['srv_z']} servers and queue size {state['queue_size']}, "
+                             f"simulation has {self.srv_z} and {self.wline.size}")
+        self.stream.restore(state['stream'], reseed=reseed, reset_stats=reset_stats)
+        self.tops = self.stream.tops()
+        
     def posttreat(self):
         
         #Easing naming
         tops = self.tops
         
-        tops['t_sojourn'] = np.where(tops['t_depart_sys'] == -1, 0, tops['t_depart_sys'] - tops['t_arval_queue'])
-        tops['t_waiting'] = np.where(tops['t_depart_sys'] == -1, 0, tops['t_arval_srv'] - tops['t_arval_queue'])
-        tops['t_service'] = np.where(tops['t_depart_sys'] == -1, 0, tops['t_depart_sys'] - tops['t_arval_srv'])
-        tops['blocked'] = tops.loc[:,'t_depart_sys'] == -1
+        tops['t_sojourn'] = np.where(tops['blocked'], 0, tops['t_depart_sys'] - tops['t_arval_queue'])
+        tops['t_waiting'] = np.where(tops['blocked'], 0, tops['t_arval_srv'] - tops['t_arval_queue'])
+        tops['t_service'] = np.where(tops['blocked'], 0, tops['t_depart_sys'] - tops['t_arval_srv'])
         tops['waited'] = tops['t_waiting'] > 0 
     
-    def timeline(self, t_delation=2):
+    def timeline(self, t_delation=2, warmup=0):
+        
+        if self.engine == 'stream':
+            if warmup:
+                raise ValueError("Streaming keeps no agent times to truncate, see steady.run_until")
+            return None, self.stream.stats()
         
         #Easing naming
         tops = self.tops
         test_z = self.test_z
+        srv_nb = self.inservice.nb
+        
+        #Sorted event times of agents that entered the system
+        served = ~tops['blocked'].to_numpy()
+        t_arval_queue = np.sort(tops['t_arval_queue'].to_numpy()[served])
+        t_arval_srv = np.sort(tops['t_arval_srv'].to_numpy()[served])
+        t_depart_sys = np.sort(tops['t_depart_sys'].to_numpy()[served])
+        t_end = t_depart_sys[-1] if t_depart_sys.size else 0.
 
-        # Process determination
+        # Process determination, counting events before each time of the range
         colnames = ['ag_in_sys', 'ag_in_queue', 'ag_in_service']
-        t_range = np.linspace(0., tops['t_depart_sys'].max(), t_delation*test_z)
-        process = pd.DataFrame(np.empty((t_range.shape[0], 3),dtype=object), 
+        t_range = np.linspace(0., t_end, t_delation*test_z)
+        arvals = np.searchsorted(t_arval_queue, t_range, side='right')
+        srv_arvals = np.searchsorted(t_arval_srv, t_range, side='left')
+        departs = np.searchsorted(t_depart_sys, t_range, side='left')
+        process = pd.DataFrame({'ag_in_sys': arvals - departs,
+                                'ag_in_queue': arvals - srv_arvals,
+                                'ag_in_service': srv_arvals - departs},
                                 index=t_range, columns=colnames)
         
-        for t in process.index:
-            process.loc[t, 'ag_in_sys'] = ((t >= tops['t_arval_queue']) & (t <= tops['t_depart_sys'])).sum()
-            process.loc[t, 'ag_in_queue'] = ((t >= tops['t_arval_queue']) & (t <= tops['t_arval_srv'])).sum()
-            process.loc[t, 'ag_in_service'] = ((t > tops['t_arval_srv']) & (t <= tops['t_depart_sys'])).sum()
+        # The first warmup arrivals are left out of the statistics, 'mser' lets MSER-5 choose them
+        # on served agents in arrival order. Rows are not always sorted by arrival (front queue
+        # of Waterfall), agents are kept by arrival time
+        if warmup == 'mser':
+            arrived = np.argsort(tops['t_arval_queue'].to_numpy()[served], kind='stable')
+            cut = mser(tops['t_sojourn'].to_numpy()[served][arrived])
+            if cut is None:
+                raise ValueError("MSER-5 found no steady state, the run is too short")
+            t_start = t_arval_queue[cut] if cut else 0.
+        else:
+            t_start = np.sort(tops['t_arval_queue'].to_numpy())[warmup] if warmup else 0.
+        kept = tops[tops['t_arval_queue'].to_numpy() >= t_start] if t_start else tops
+        
+        # Busy servers between successive service events, for exact time-weighted usage
+        t_events = np.concatenate((t_arval_srv, t_depart_sys))
+        order = np.argsort(t_events, kind='stable')
+        busy = np.cumsum(np.concatenate((np.ones(t_arval_srv.size), -np.ones(t_depart_sys.size)))[order])
+        durations = np.diff(np.maximum(t_events[order], t_start), append=t_end)
+        
+        # Areas under the queue and service processes, clipped to the window after warm-up
+        if t_start:
+            area_queue = (np.clip(t_arval_srv, t_start, t_end) - np.clip(t_arval_queue, t_start, t_end)).sum()
+            area_service = (np.clip(t_depart_sys, t_start, t_end) - np.clip(t_arval_srv, t_start, t_end)).sum()
+            area_system = area_queue + area_service
+        else:
+            area_queue = tops['t_waiting'].sum()
+            area_service = tops['t_service'].sum()
+            area_system = tops['t_sojourn'].sum()
+        window = t_end - t_start
         
         # Statistics extractions
         statnames = ['mean_sojourn_time', 'mean_waiting_time', 'mean_service_time', 
-                     'waiting_proportion', 'blocked_proportion', 'servers_max_usage']
+                     'waiting_proportion', 'blocked_proportion', 'servers_max_usage',
+                     'servers_usage', 'mean_queue_length', 'mean_agents_in_system']
         stats = pd.DataFrame(np.empty((len(statnames), 1),dtype=object), index=statnames, columns=['run value'])
  
-        stats.loc['mean_sojourn_time'] = tops['t_sojourn'].sum() / (~tops['blocked']).sum()
-        stats.loc['mean_waiting_time'] = tops['t_waiting'].sum() / (~tops['blocked']).sum()
-        stats.loc['mean_service_time'] = tops['t_service'].sum() / (~tops['blocked']).sum()
+        stats.loc['mean_sojourn_time'] = kept['t_sojourn'].sum() / (~kept['blocked']).sum()
+        stats.loc['mean_waiting_time'] = kept['t_waiting'].sum() / (~kept['blocked']).sum()
+        stats.loc['mean_service_time'] = kept['t_service'].sum() / (~kept['blocked']).sum()
 
-        stats.loc['waiting_proportion'] = tops['waited'].sum() / (~tops['blocked']).sum()
-        stats.loc['blocked_proportion'] = tops['blocked'].sum() / test_z
+        stats.loc['waiting_proportion'] = kept['waited'].sum() / (~kept['blocked']).sum()
+        stats.loc['blocked_proportion'] = kept['blocked'].sum() / len(kept)
 
-        # An approximation of server usage, for better approximation raise t_delation.
-        stats.loc['servers_max_usage'] = (process['ag_in_service'] == self.inservice.nb).sum() / (t_delation*test_z - 1)
+        # Time-weighted over the run, each agent contributes its own durations to the areas
+        stats.loc['servers_max_usage'] = durations[busy >= srv_nb].sum() / window
+        stats.loc['servers_usage'] = area_service / (srv_nb * window)
+        stats.loc['mean_queue_length'] = area_queue / window
+        stats.loc['mean_agents_in_system'] = area_system / window
 
         return process, stats
\ No newline at end of file
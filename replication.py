@@ -0,0 +1,69 @@
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from steady import student_quantile
+from waterfall import Waterfall
+
+
+def run_replication(build, seed, t_delation=2):
+    """
+    Simule une réplication construite par build(seed) et retourne ses statistiques.
+    """
+    simulation = build(seed)
+
+    if isinstance(simulation, Waterfall):
+        simulation.run()
+        stats = simulation.posttreat()
+        return pd.concat({queue: stats[queue]['run value'] for queue in stats}).astype(float)
+
+    simulation.pretreat()
+    simulation.run()
+    simulation.posttreat()
+    return simulation.timeline(t_delation)[1]['run value'].astype(float)
+
+
+def summarize(samples, confidence=0.95):
+    """
+    Moyenne, écart-type et intervalle de confiance de Student de chaque statistique.
+    """
+    count = samples.count()
+    mean = samples.mean()
+    std = samples.std(ddof=1)
+    quantiles = count.map(lambda n: student_quantile(confidence, n - 1) if n > 1 else np.nan)
+    half_width = quantiles * std / np.sqrt(count)
+
+    return pd.DataFrame({
+        'mean': mean,
+        'std': std,
+        'half_width': half_width,
+        'ci_low': mean - half_width,
+        'ci_high': mean + half_width
+    })
+
+
+def replicate(build, nb_replications, seed=None, workers=None, confidence=0.95, t_delation=2):
+    """
+    Lance nb_replications réplications indépendantes sur un pool de processus.
+
+    build(seed) doit retourner un QS ou un Waterfall dont les distributions sont tirées
+    d'un générateur np.random.default_rng(seed). Chaque réplication reçoit sa propre
+    graine issue de np.random.SeedSequence(seed).spawn, les résultats ne dépendent donc
+    pas du nombre de workers. build doit être picklable (fonction définie au niveau module).
+
+    Retourne les statistiques de chaque réplication et leur résumé.
+    """
+    seeds = np.random.SeedSequence(seed).spawn(nb_replications)
+
+    if workers == 1:
+        results = [run_replication(build, child, t_delation) for child in seeds]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(run_replication, [build] * nb_replications, seeds,
+                                    [t_delation] * nb_replications))
+
+    samples = pd.DataFrame(results).reset_index(drop=True)
+    samples.index.name = 'replication'
+
+    return samples, summarize(samples, confidence)
@@ -0,0 +1,133 @@
+import math
+
+import numpy as np
+import pandas as pd
+
+
+def student_quantile(confidence, df):
+    """
+    Quantile bilatéral de la loi de Student à df degrés de liberté, tel que P(|T| <= t) = confidence.
+    """
+    def coverage(t):
+        # Formules exactes pour df entier (Abramowitz & Stegun 26.7.3 et 26.7.4)
+        theta = math.atan(t / math.sqrt(df))
+        cos2 = math.cos(theta) ** 2
+        term, total = 1., 1.
+        for k in range(1 + df % 2, df - 1, 2):
+            term *= cos2 * k / (k + 1)
+            total += term
+        if df % 2 == 0:
+            return math.sin(theta) * total
+        if df == 1:
+            return 2 * theta / math.pi
+        return 2 / math.pi * (theta + math.sin(theta) * math.cos(theta) * total)
+
+    low, high = 0., 1.
+    while coverage(high) < confidence:
+        high *= 2
+    for _ in range(100):
+        mid = (low + high) / 2
+        if coverage(mid) < confidence:
+            low = mid
+        else:
+            high = mid
+    return (low + high) / 2
+
+
+def mser(values, batch_size=5):
+    """
+    Nombre d'observations de démarrage à écarter selon la règle MSER-5 (White, 1997).
+
+    Les observations sont moyennées par lots de batch_size, la troncature retenue minimise la
+    variance de la moyenne des lots restants divisée par leur nombre. Retourne None si le minimum
+    tombe en fin de recherche (moitié des lots) : la série n'a pas encore atteint son régime.
+    """
+    n = len(values) // batch_size
+    if n < 4:
+        return None
+    means = np.asarray(values[:n * batch_size], dtype=float).reshape(n, batch_size).mean(axis=1)
+
+    # Sommes des moyennes restantes pour chaque troncature d, par cumuls inverses
+    count = n - np.arange(n)
+    total = np.cumsum(means[::-1])[::-1]
+    squares = np.cumsum(means[::-1] ** 2)[::-1]
+    statistic = (squares - total ** 2 / count) / count ** 2
+
+    d = int(np.argmin(statistic[:n // 2 + 1]))
+    return None if d == n // 2 else d * batch_size
+
+
+def batch_means(values, nb_batches=20, confidence=0.95):
+    """
+    Moyenne et demi-largeur de l'intervalle de confiance par la méthode des lots : les
+    observations sont groupées en nb_batches lots consécutifs, les premières en surplus écartées.
+    """
+    size = len(values) // nb_batches
+    if size == 0:
+        return np.nan, np.nan
+    means = np.asarray(values[len(values) - size * nb_batches:], dtype=float).reshape(nb_batches, size).mean(axis=1)
+    half_width = student_quantile(confidence, nb_batches - 1) * means.std(ddof=1) / math.sqrt(nb_batches)
+    return means.mean(), half_width
+
+
+class Collector():
+    """
+    Temps des agents entrés en service, dans l'ordre, relevés par paquet sur un Stream.
+    """
+
+    def __init__(self):
+        self.chunks = {'sojourn': [], 'waiting': [], 'service': []}
+
+    def __call__(self, t_arval_queue, t_arval_srv, t_depart_sys):
+        self.chunks['sojourn'].append(t_depart_sys - t_arval_queue)
+        self.chunks['waiting'].append(t_arval_srv - t_arval_queue)
+        self.chunks['service'].append(t_depart_sys - t_arval_srv)
+
+    def values(self, name):
+        # Les paquets sont regroupés au premier accès pour ne pas recopier à chaque étape
+        chunks = self.chunks[name]
+        if len(chunks) > 1:
+            chunks[:] = [np.concatenate(chunks)]
+        return chunks[0] if chunks else np.empty(0)
+
+
+def run_until(simulation, precision=0.05, confidence=0.95, step=None, max_agents=10**7, nb_batches=20):
+    """
+    Poursuit une simulation 'stream' par étapes d'au moins step arrivées (test_size par défaut) jusqu'à
+    ce que la demi-largeur de l'intervalle de confiance de mean_sojourn_time, après suppression
+    du démarrage par MSER-5 et par la méthode des lots, soit sous precision fois la moyenne.
+
+    S'arrête aussi après max_agents arrivées. Retourne les moyennes après démarrage, la
+    troncature (en agents servis), le nombre d'agents simulés et si la précision est atteinte.
+    """
+    if simulation.engine != 'stream':
+        raise ValueError("Only the 'stream' engine can run until a target precision")
+    step = step or simulation.test_z
+    collector = Collector()
+    simulation.stream.observers.append(collector)
+    mean = half_width = np.nan
+
+    try:
+        while True:
+            # Les étapes suivent le total simulé pour ne pas refaire MSER-5 à chaque petit paquet
+            agents = simulation.stream.agent
+            simulation.extend(min(max(step, agents // 10), max_agents - agents))
+            sojourn = collector.values('sojourn')
+            warmup = mser(sojourn)
+            if warmup is not None:
+                mean, half_width = batch_means(sojourn[warmup:], nb_batches, confidence)
+                if half_width <= precision * abs(mean):
+                    break
+            if simulation.stream.agent >= max_agents:
+                break
+    finally:
+        simulation.stream.observers.remove(collector)
+
+    summary = {'agents': simulation.stream.agent, 'warmup': warmup,
+               'reached': bool(half_width <= precision * abs(mean))}
+    if warmup is not None:
+        summary.update({'mean_sojourn_time': mean, 'half_width': half_width,
+                        'relative_precision': half_width / abs(mean),
+                        'mean_waiting_time': collector.values('waiting')[warmup:].mean(),
+                        'mean_service_time': collector.values('service')[warmup:].mean()})
+    return pd.Series(summary, dtype=object)
@@ -0,0 +1,379 @@
+import bisect
+import heapq
+
+import numpy as np
+import pandas as pd
+
+from instrument import disabled
+
+
+class Welford():
+    """
+    Moyenne et variance glissantes, mises à jour par paquets (formule de Chan).
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.
+        self.m2 = 0.
+
+    def update(self, values):
+        if len(values) == 0:
+            return
+        count = len(values)
+        mean = values.mean()
+        m2 = ((values - mean) ** 2).sum()
+
+        delta = mean - self.mean
+        total = self.count + count
+        self.mean += delta * count / total
+        self.m2 += m2 + delta ** 2 * self.count * count / total
+        self.count = total
+
+    def variance(self):
+        return self.m2 / (self.count - 1) if self.count > 1 else np.nan
+
+
+class P2Quantile():
+    """
+    Estimation d'un quantile en mémoire constante par l'algorithme P² (Jain et Chlamtac).
+    """
+
+    def __init__(self, p):
+        self.p = p
+        self.heights = []
+        self.positions = [1., 2., 3., 4., 5.]
+        self.desired = [1., 1. + 2*p, 1. + 4*p, 3. + 2*p, 5.]
+        self.increments = [0., p / 2, p, (1. + p) / 2, 1.]
+
+    def update(self, values):
+        q = self.heights
+        n = self.positions
+        desired = self.desired
+        increments = self.increments
+
+        for x in values:
+            if len(q) < 5:
+                bisect.insort(q, x)
+                continue
+
+            # Cellule de l'observation, les marqueurs extrêmes suivent le min et le max
+            if x < q[0]:
+                q[0] = x
+                k = 0
+            elif x >= q[4]:
+                q[4] = x
+                k = 3
+            else:
+                k = bisect.bisect_right(q, x) - 1
+
+            for i in range(k + 1, 5):
+                n[i] += 1
+            for i in range(5):
+                desired[i] += increments[i]
+
+            # Ajustement des marqueurs centraux, parabolique sinon linéaire
+            for i in (1, 2, 3):
+                d = desired[i] - n[i]
+                if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                    d = 1 if d > 0 else -1
+                    height = q[i] + d / (n[i + 1] - n[i - 1]) * (
+                        (n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i])
+                        + (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1]))
+                    if not q[i - 1] < height < q[i + 1]:
+                        height = q[i] + d * (q[i + d] - q[i]) / (n[i + d] - n[i])
+                    q[i] = height
+                    n[i] += d
+
+    def value(self):
+        if len(self.heights) < 5:
+            return np.quantile(self.heights, self.p) if self.heights else np.nan
+        return self.heights[2]
+
+
+class Aggregates():
+    """
+    Agrégats d'une file d'attente : temps des agents servis, nombre de bloqués et aires sous les
+    processus d'occupation.
+    """
+
+    def __init__(self, srv_nb, probs=(0.5, 0.9, 0.99)):
+        self.srv_nb = srv_nb
+        self.arrived = 0
+        self.blocked = 0
+        self.waited = 0
+        self.sojourn = Welford()
+        self.waiting = Welford()
+        self.service = Welford()
+        self.quantiles = [P2Quantile(p) for p in probs]
+        self.start = 0.
+        self.clock = 0.
+        self.area_queue = 0.
+        self.area_service = 0.
+        self.time_full = 0.
+
+    def advance(self, t, in_queue, in_service):
+        dt = t - self.clock
+        self.area_queue += dt * in_queue
+        self.area_service += dt * in_service
+        if in_service == self.srv_nb:
+            self.time_full += dt
+        self.clock = t
+
+    def update(self, t_arval_queue, t_arval_srv, t_depart_sys):
+        """
+        Intègre les temps d'un paquet d'agents entrés en service.
+        """
+        if len(t_arval_queue) == 0:
+            return
+        t_waiting = t_arval_srv - t_arval_queue
+        t_sojourn = t_depart_sys - t_arval_queue
+
+        self.waited += int((t_waiting > 0).sum())
+        self.sojourn.update(t_sojourn)
+        self.waiting.update(t_waiting)
+        self.service.update(t_depart_sys - t_arval_srv)
+        for quantile in self.quantiles:
+            quantile.update(t_sojourn.tolist())
+
+    def stats(self):
+        """
+        Statistiques agrégées, avec les mêmes noms que QS.timeline.
+        """
+        served = self.sojourn.count
+        clock = self.clock - self.start
+
+        statnames = ['mean_sojourn_time', 'mean_waiting_time', 'mean_service_time',
+                     'waiting_proportion', 'blocked_proportion', 'servers_max_usage',
+                     'servers_usage', 'mean_queue_length', 'mean_agents_in_system',
+                     'std_sojourn_time', 'std_waiting_time', 'std_service_time']
+        statnames += [f'sojourn_time_q{quantile.p:g}' for quantile in self.quantiles]
+        stats = pd.DataFrame(np.empty((len(statnames), 1), dtype=object), index=statnames, columns=['run value'])
+
+        stats.loc['mean_sojourn_time'] = self.sojourn.mean
+        stats.loc['mean_waiting_time'] = self.waiting.mean
+        stats.loc['mean_service_time'] = self.service.mean
+
+        stats.loc['waiting_proportion'] = self.waited / served if served else np.nan
+        stats.loc['blocked_proportion'] = self.blocked / self.arrived if self.arrived else np.nan
+
+        # Moyennes temporelles jusqu'au dernier évènement traité
+        stats.loc['servers_max_usage'] = self.time_full / clock
+        stats.loc['servers_usage'] = self.area_service / (self.srv_nb * clock)
+        stats.loc['mean_queue_length'] = self.area_queue / clock
+        stats.loc['mean_agents_in_system'] = (self.area_queue + self.area_service) / clock
+
+        stats.loc['std_sojourn_time'] = np.sqrt(self.sojourn.variance())
+        stats.loc['std_waiting_time'] = np.sqrt(self.waiting.variance())
+        stats.loc['std_service_time'] = np.sqrt(self.service.variance())
+        for quantile in self.quantiles:
+            stats.loc[f'sojourn_time_q{quantile.p:g}'] = quantile.value()
+
+        return stats
+
+
+class Stream():
+    """
+    Simulation par paquets d'arrivées d'une file d'attente sans garder une ligne par agent.
+
+    Seuls les agrégats sont conservés : moyennes et variances des temps, quantiles P² du temps
+    de séjour, nombre de bloqués et aires sous les processus d'occupation. Un agent sur
+    trace_every est gardé dans une trace. La mémoire ne dépend que du nombre d'agents en cours.
+    """
+
+    def __init__(self, arval_dist, wline, inservice, capacity, chunk_size=10000,
+                 trace_every=None, probs=(0.5, 0.9, 0.99), probe=disabled, writer=None):
+        self.arval_dist = arval_dist
+        self.wline = wline
+        self.inservice = inservice
+        self.capacity = capacity
+        self.chunk_size = chunk_size
+        self.trace_every = trace_every
+        self.probe = probe
+        self.writer = writer
+
+        # Etat de la simulation
+        self.agent = 0
+        self.t_arval = 0.
+        self.busy = []
+        self.idle = [(0., srv_ix) for srv_ix in range(inservice.nb)]
+        self.arvals = {}
+        self.services = {}
+        self.wline.populate([])
+        self.inservice.server = [None] * inservice.nb
+
+        self.aggregates = Aggregates(inservice.nb, probs)
+        self.trace = []
+
+        # Fonctions appelées avec les temps de chaque paquet d'agents entrés en service
+        self.observers = []
+
+    def run(self, nb_agents):
+        """
+        Poursuit la simulation sur nb_agents arrivées supplémentaires.
+        """
+        # Easing naming
+        wline = self.wline
+        inservice = self.inservice
+        dist = inservice.dist
+        busy = self.busy
+        idle = self.idle
+        arvals = self.arvals
+        services = self.services
+        capacity = self.capacity.size
+        aggregates = self.aggregates
+        pop = wline.pop
+        probe = self.probe
+        tracking = probe.enabled
+        if tracking:
+            pop = probe.timed('wline.pop', pop)
+        writing = self.writer is not None
+
+        while nb_agents > 0:
+            chunk = min(self.chunk_size, nb_agents)
+            t_arvals = self.t_arval + np.cumsum(self.arval_dist(size=chunk))
+            self.t_arval = t_arvals[-1]
+
+            # Agents servis dans le paquet : (agent, arrivée, début de service, départ, serveur)
+            started = []
+            blocked = []
+
+            # Etat (instant, en file, en service) après chaque évènement, s'il est écrit sur disque
+            events = []
+
+            def start(agent, t, srv_ix):
+                t_dept = t + (services.pop(agent) if agent in services else dist())
+                started.append((agent, arvals.pop(agent), t, t_dept, srv_ix))
+                inservice.server[srv_ix] = agent
+                heapq.heappush(busy, (t_dept, srv_ix))
+
+            for t in t_arvals.tolist():
+                # Départs jusqu'à l'arrivée, un serveur libéré prend le suivant de la file
+                while busy and busy[0][0] <= t:
+                    aggregates.advance(busy[0][0], len(wline), len(busy))
+                    t_dept, srv_ix = heapq.heappop(busy)
+                    _next = pop()
+                    if _next is not None:
+                        start(_next, t_dept, srv_ix)
+                    else:
+                        heapq.heappush(idle, (t_dept, srv_ix))
+                    if writing:
+                        events.append((t_dept, len(wline), len(busy)))
+                aggregates.advance(t, len(wline), len(busy))
+
+                agent = self.agent
+                self.agent += 1
+                if len(busy) + len(wline) >= capacity:
+                    blocked.append((agent, t))
+                    continue
+                arvals[agent] = t
+                if idle:
+                    start(agent, t, heapq.heappop(idle)[1])
+                elif wline.by_service:
+                    services[agent] = dist()
+                    wline.push(agent, services[agent])
+                else:
+                    wline.push(agent)
+                if tracking:
+                    probe.high_water('queue', len(wline))
+                if writing:
+                    events.append((t, len(wline), len(busy)))
+
+            with probe.phase('flush'):
+                self.flush(chunk, started, blocked)
+                if writing:
+                    self.writer.add_arrivals(chunk)
+                    self.write(started, blocked, events)
+            nb_agents -= chunk
+
+        if writing:
+            self.writer.commit()
+
+    def write(self, started, blocked, events):
+        """
+        Ecrit sur disque les agents et le processus d'occupation du dernier paquet.
+        """
+        rows = started + [(agent, t, np.nan, np.nan, -1) for agent, t in blocked]
+        agent, t_arval_queue, t_arval_srv, t_depart_sys, server = np.array(rows).T if rows else [[]] * 5
+        server = np.asarray(server, dtype=np.int32)
+        self.writer.write_agents({'agent': agent, 't_arval_queue': t_arval_queue, 't_arval_srv': t_arval_srv,
+                                  't_depart_sys': t_depart_sys, 'blocked': server < 0, 'server': server})
+        if events:
+            self.writer.write_process(*np.array(events).T)
+
+    def flush(self, chunk, started, blocked):
+        """
+        Intègre aux agrégats les agents du dernier paquet.
+        """
+        self.aggregates.arrived += chunk
+        self.aggregates.blocked += len(blocked)
+        if started:
+            _, t_arval_queue, t_arval_srv, t_depart_sys, _ = np.array(started).T
+            self.aggregates.update(t_arval_queue, t_arval_srv, t_depart_sys)
+            self.probe.count('waited', (t_arval_srv > t_arval_queue).sum())
+            for observer in self.observers:
+                observer(t_arval_queue, t_arval_srv, t_depart_sys)
+
+        self.probe.count('arrivals', chunk)
+        self.probe.count('blocked', len(blocked))
+        self.probe.count('served', len(started))
+
+        if self.trace_every:
+            self.trace += [row for row in started if row[0] % self.trace_every == 0]
+            self.trace += [(agent, t, np.nan, np.nan, -1) for agent, t in blocked if agent % self.trace_every == 0]
+
+    def state(self):
+        """
+        Etat de la simulation entre deux paquets, sans les distributions.
+        """
+        return {'agent': self.agent, 't_arval': self.t_arval, 'busy': self.busy, 'idle': self.idle,
+                'arvals': self.arvals, 'services': self.services, 'server': self.inservice.server,
+                'sampler': self.inservice.dist.state(), 'wline': self.wline.discipline.state(),
+                'aggregates': self.aggregates, 'trace': self.trace,
+                'arrivals': self.arval_dist.state() if hasattr(self.arval_dist, 'state') else None}
+
+    def restore(self, state, reseed=False, reset_stats=False):
+        """
+        Reprend un état enregistré. Avec reseed, les services déjà tirés sont écartés pour que la
+        suite ne dépende que des générateurs actuels. Avec reset_stats, les agrégats et la trace
+        repartent de l'instant de reprise.
+        """
+        self.agent = state['agent']
+        self.t_arval = state['t_arval']
+        self.busy = state['busy']
+        self.idle = state['idle']
+        self.arvals = state['arvals']
+        self.services = state['services']
+        self.inservice.server = state['server']
+        self.wline.restore(state['wline'])
+        if state['arrivals'] is not None:
+            self.arval_dist.restore(state['arrivals'])
+        if not reseed:
+            self.inservice.dist.restore(state['sampler'])
+
+        self.aggregates = state['aggregates']
+        self.trace = state['trace']
+        if reset_stats:
+            clock = self.aggregates.clock
+            self.aggregates = Aggregates(self.aggregates.srv_nb, [quantile.p for quantile in self.aggregates.quantiles])
+            self.aggregates.start = self.aggregates.clock = clock
+            self.trace = []
+
+    def tops(self):
+        """
+        Trace échantillonnée au format de QS.tops, indexée par numéro d'agent.
+        """
+        rows = sorted(self.trace)
+        agents, t_arval_queue, t_arval_srv, t_depart_sys, server = zip(*rows) if rows else [()] * 5
+
+        # Les agents bloqués n'ont pas de serveur
+        server = np.array(server, dtype=np.int32)
+        columns = {'t_arval_queue': np.array(t_arval_queue, dtype=float),
+                   't_arval_srv': np.array(t_arval_srv, dtype=float),
+                   't_depart_sys': np.array(t_depart_sys, dtype=float),
+                   'blocked': server < 0,
+                   'server': server}
+        return pd.DataFrame(columns, index=np.array(agents, dtype=np.int64), copy=False)
+
+    def stats(self):
+        return self.aggregates.stats()
@@ -0,0 +1,99 @@
+import hashlib
+import itertools
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from functools import partial
+
+import pandas as pd
+
+import analytic
+from arrivals import Arrivals
+from replication import run_replication
+from waterfall import Waterfall
+
+
+def build_waterfall(params, seed):
+    return Waterfall(**params, seed=seed)
+
+
+def jsonable(x):
+    # Scalaires numpy, et arrivées non homogènes (arrivals.Arrivals) par leur description
+    return x.describe() if isinstance(x, Arrivals) else x.item()
+
+
+def point_key(params, seed):
+    """
+    Clé de cache d'un point de la grille, à partir de ses paramètres et de sa graine.
+    """
+    payload = json.dumps({'params': params, 'seed': seed}, sort_keys=True, default=jsonable)
+    return hashlib.sha1(payload.encode()).hexdigest()
+
+
+def run_point(params, seed, t_delation=2):
+    stats = run_replication(partial(build_waterfall, params), seed, t_delation)
+    return {queue: stats[queue].to_dict() for queue in stats.index.levels[0]}
+
+
+def analytic_point(params):
+    theory = analytic.waterfall(**params)
+    return {queue: theory[queue].to_dict() for queue in theory}
+
+
+def sweep(grid, seed=42, cache_dir='sweep_cache', workers=None, t_delation=2, use_theory=False, **fixed):
+    """
+    Simule Waterfall sur toutes les combinaisons de la grille de paramètres.
+
+    grid associe à des paramètres de Waterfall (nb_servers_test, q_test_size, ...) la liste
+    des valeurs à tester, les autres paramètres sont fixés par fixed. Chaque point terminé est
+    enregistré dans cache_dir, une relance ne simule que les points manquants.
+
+    Avec use_theory, les points dont la théorie est exacte (analytic.exact_waterfall) ne sont
+    pas simulés : leurs statistiques stationnaires sont calculées, la colonne source l'indique.
+
+    Retourne une ligne par configuration et par queue avec ses statistiques.
+    """
+    names = list(grid)
+    points = [{**fixed, **dict(zip(names, values))} for values in itertools.product(*grid.values())]
+
+    os.makedirs(cache_dir, exist_ok=True)
+    paths = [os.path.join(cache_dir, point_key(params, seed) + '.json') for params in points]
+    results = {}
+    sources = {path: 'simulation' for path in paths}
+
+    if use_theory:
+        for params, path in zip(points, paths):
+            if analytic.exact_waterfall(**params):
+                results[path] = analytic_point(params)
+                sources[path] = 'analytic'
+
+    for path in paths:
+        if path in results:
+            continue
+        if os.path.exists(path):
+            with open(path) as f:
+                results[path] = json.load(f)['stats']
+
+    missing = [(params, path) for params, path in zip(points, paths) if path not in results]
+    if missing:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(run_point, params, seed, t_delation): (params, path) for params, path in missing}
+            for future in as_completed(futures):
+                params, path = futures[future]
+                results[path] = future.result()
+
+                # Ecriture atomique pour ne pas laisser de point corrompu en cas d'interruption
+                with open(path + '.tmp', 'w') as f:
+                    json.dump({'params': params, 'seed': seed, 'stats': results[path]}, f,
+                              default=jsonable)
+                os.replace(path + '.tmp', path)
+
+    rows = []
+    for params, path in zip(points, paths):
+        for queue, stats in results[path].items():
+            row = {name: params[name] for name in names}
+            if use_theory:
+                row['source'] = sources[path]
+            rows.append({**row, 'queue': queue, **stats})
+
+    return pd.DataFrame(rows)
@@ -0,0 +1,177 @@
+import heapq
+
+import numpy as np
+import pandas as pd
+
+from qs import InService, Wline, fifo
+from stream import Aggregates, P2Quantile, Welford
+
+
+class Stage():
+    """
+    Une file du réseau en tandem : serveurs, file d'attente et agrégats propres.
+    """
+
+    def __init__(self, srv_dist, servers_nb=1, queue_size=None, policy=fifo, name=None, probs=(0.5, 0.9, 0.99)):
+        self.name = name
+        self.wline = Wline(size=queue_size, policy=policy)
+        self.inservice = InService(nb=servers_nb, dist=srv_dist)
+        self.capacity = queue_size + servers_nb if queue_size else np.inf
+
+        # Etat de la file, les départs des serveurs occupés sont dans le calendrier du réseau
+        self.busy = 0
+        self.idle = [(0., srv_ix) for srv_ix in range(servers_nb)]
+        self.arvals = {}
+        self.services = {}
+
+        # Agents entrés en service depuis le dernier paquet : (arrivée, début de service, départ)
+        self.started = []
+        self.aggregates = Aggregates(servers_nb, probs)
+
+    def flush(self):
+        if self.started:
+            t_arval_queue, t_arval_srv, t_depart_sys = np.array(self.started).T
+            self.aggregates.update(t_arval_queue, t_arval_srv, t_depart_sys)
+            self.started = []
+
+
+class Tandem():
+    """
+    Réseau de files en tandem simulé en une passe avec un seul calendrier d'évènements.
+
+    Les départs d'une file sont des arrivées immédiates pour la suivante, un client bloqué à une
+    file quitte le réseau. Les arrivées externes sont tirées par paquets de chunk_size et seuls
+    les agrégats de chaque file et du réseau sont gardés : la mémoire ne dépend que du nombre de
+    clients en cours.
+    """
+
+    def __init__(self, arval_dist, stages, chunk_size=10000, probs=(0.5, 0.9, 0.99)):
+        self.arval_dist = arval_dist
+        self.stages = stages
+        self.chunk_size = chunk_size
+
+        # Calendrier des départs : (départ, -file, serveur, client), à temps égal les files
+        # en aval libèrent leurs serveurs avant de recevoir les clients de l'amont
+        self.calendar = []
+        self.customer = 0
+        self.t_arval = 0.
+        self.entries = {}
+
+        # Agrégats du réseau de bout en bout
+        self.lost = 0
+        self.clock = 0.
+        self.area = 0.
+        self.sojourn = Welford()
+        self.quantiles = [P2Quantile(p) for p in probs]
+        self.exits = []
+
+    def advance(self, stage, t):
+        stage.aggregates.advance(t, len(stage.wline), stage.busy)
+        self.area += (t - self.clock) * len(self.entries)
+        self.clock = t
+
+    def start(self, k, customer, t, srv_ix):
+        stage = self.stages[k]
+        service = stage.services.pop(customer) if customer in stage.services else stage.inservice.dist()
+        stage.busy += 1
+        stage.inservice.server[srv_ix] = customer
+        stage.started.append((stage.arvals.pop(customer), t, t + service))
+        heapq.heappush(self.calendar, (t + service, -k, srv_ix, customer))
+
+    def arrive(self, k, customer, t):
+        stage = self.stages[k]
+        self.advance(stage, t)
+        stage.aggregates.arrived += 1
+
+        if stage.busy + len(stage.wline) >= stage.capacity:
+            stage.aggregates.blocked += 1
+            self.lost += 1
+            del self.entries[customer]
+            return
+
+        stage.arvals[customer] = t
+        if stage.idle:
+            self.start(k, customer, t, heapq.heappop(stage.idle)[1])
+        elif stage.wline.by_service:
+            stage.services[customer] = stage.inservice.dist()
+            stage.wline.push(customer, stage.services[customer])
+        else:
+            stage.wline.push(customer)
+
+    def depart(self, t, k, srv_ix, customer):
+        k = -k
+        stage = self.stages[k]
+        self.advance(stage, t)
+        stage.busy -= 1
+
+        # Le serveur libéré prend le suivant de la file
+        _next = stage.wline.pop()
+        if _next is not None:
+            self.start(k, _next, t, srv_ix)
+        else:
+            heapq.heappush(stage.idle, (t, srv_ix))
+
+        if k + 1 < len(self.stages):
+            self.arrive(k + 1, customer, t)
+        else:
+            self.exits.append((self.entries.pop(customer), t))
+
+    def run(self, nb_customers):
+        """
+        Poursuit la simulation sur nb_customers arrivées externes supplémentaires.
+        """
+        calendar = self.calendar
+
+        while nb_customers > 0:
+            chunk = min(self.chunk_size, nb_customers)
+            t_arvals = self.t_arval + np.cumsum(self.arval_dist(size=chunk))
+            self.t_arval = t_arvals[-1]
+
+            for t in t_arvals.tolist():
+                while calendar and calendar[0][0] <= t:
+                    self.depart(*heapq.heappop(calendar))
+
+                customer = self.customer
+                self.customer += 1
+                self.entries[customer] = t
+                self.arrive(0, customer, t)
+
+            self.flush()
+            nb_customers -= chunk
+
+    def drain(self):
+        """
+        Termine le service des clients encore dans le réseau, sans nouvelle arrivée.
+        """
+        while self.calendar:
+            self.depart(*heapq.heappop(self.calendar))
+        self.flush()
+
+    def flush(self):
+        for stage in self.stages:
+            stage.flush()
+        if self.exits:
+            t_entry, t_exit = np.array(self.exits).T
+            t_sojourn = t_exit - t_entry
+            self.sojourn.update(t_sojourn)
+            for quantile in self.quantiles:
+                quantile.update(t_sojourn.tolist())
+            self.exits = []
+
+    def stats(self):
+        """
+        Statistiques de chaque file et du réseau de bout en bout, avec les noms de QS.timeline.
+        """
+        names = [stage.name or f'Stage {k}' for k, stage in enumerate(self.stages)]
+        stats = pd.concat([stage.aggregates.stats()['run value'] for stage in self.stages], axis=1, keys=names)
+
+        network = pd.Series(np.nan, index=stats.index, dtype=object)
+        network['mean_sojourn_time'] = self.sojourn.mean
+        network['std_sojourn_time'] = np.sqrt(self.sojourn.variance())
+        network['blocked_proportion'] = self.lost / self.customer if self.customer else np.nan
+        network['mean_agents_in_system'] = self.area / self.clock if self.clock else np.nan
+        for quantile in self.quantiles:
+            network[f'sojourn_time_q{quantile.p:g}'] = quantile.value()
+        stats['Network'] = network
+
+        return stats
@@ -0,0 +1,80 @@
+import numpy as np
+import pytest
+
+from qs import QS
+
+
+#Blocked agents of the original QS.run, which rescanned all prior departures for each arrival,
+#for (servers_nb, queue_size, seed) with run_qs parameters
+BASELINE_BLOCKED = {
+    (1, None, 0): [],
+    (1, None, 1): [],
+    (1, 1, 0): [3, 4, 13, 14, 15, 18, 19, 20, 21, 22, 23, 26, 29, 30, 35, 36, 38, 42, 45, 46, 51, 53, 54, 55, 57, 58, 59],
+    (1, 1, 1): [4, 8, 10, 11, 13, 14, 15, 16, 17, 18, 19, 27, 33, 34, 37, 42, 51, 52, 53, 55, 58, 59],
+    (1, 3, 0): [15, 19, 20, 21, 27, 28, 29, 30, 32, 43, 44, 45, 46, 48, 49, 52, 53, 55, 56, 57, 59],
+    (1, 3, 1): [10, 11, 13, 14, 15, 16, 17, 18, 19, 51, 53, 55, 56, 57, 59],
+    (2, None, 0): [],
+    (2, None, 1): [],
+    (2, 1, 0): [4, 14, 15, 17, 18, 20, 21, 22, 26, 31, 32, 33, 34, 37, 42, 44, 48, 49, 53, 54, 55, 56, 57, 58, 59],
+    (2, 1, 1): [6, 10, 11, 12, 13, 14, 15, 16, 20, 26, 37, 38, 51, 53, 54, 58, 59],
+    (2, 3, 0): [17, 19, 20, 21, 22, 26, 30, 33, 34, 35, 44, 45, 46, 47, 51, 52, 53, 54, 56, 57, 59],
+    (2, 3, 1): [11, 12, 13, 14, 15, 18, 51, 52, 53, 54, 55, 56, 57, 58, 59],
+    (3, None, 0): [],
+    (3, None, 1): [],
+    (3, 1, 0): [13, 15, 18, 19, 21, 22, 23, 26, 31, 33, 34, 35, 37, 41, 42, 46, 49, 51, 53, 55, 56, 57, 58, 59],
+    (3, 1, 1): [7, 12, 13, 15, 16, 17, 18, 24, 25, 34, 51, 53, 54, 57, 58, 59],
+    (3, 3, 0): [18, 19, 21, 22, 23, 26, 32, 33, 35, 39, 45, 46, 47, 48, 49, 53, 54, 55, 56, 57, 59],
+    (3, 3, 1): [13, 15, 16, 17, 18, 46, 52, 53, 54, 55, 57, 58, 59],
+}
+
+#A few departure times of served agents from the same original runs, by agent index
+BASELINE_DEPARTURES = {
+    (1, None, 0): {24: 41.7383848376, 25: 43.3827733184, 26: 45.0791810825, 27: 45.685356534},
+    (1, 1, 0): {24: 32.3139797875, 25: 34.7365687408, 27: 35.7517587963, 28: 36.6446365098},
+    (1, 3, 0): {24: 37.7736756366, 25: 38.3999942079, 26: 40.5060330747, 31: 41.7239255987},
+    (2, None, 0): {24: 42.766199781, 25: 46.0549767427, 26: 47.3898136801, 27: 47.2673276457},
+    (2, 1, 0): {24: 32.8494194826, 25: 34.2911532753, 27: 33.6593609272, 28: 45.8963510683},
+    (2, 3, 0): {24: 42.7372813032, 25: 36.0964982278, 27: 37.3491353705, 28: 41.561213104},
+    (3, None, 0): {24: 41.2071780709, 25: 46.1403435135, 26: 47.5389549143, 27: 47.9588698679},
+    (3, 1, 0): {24: 32.9667280399, 25: 32.4322667795, 27: 49.5142383589, 28: 41.2233021144},
+    (3, 3, 0): {24: 48.1323890858, 25: 38.7960540501, 27: 35.3638913708, 28: 41.682007971},
+}
+
+ENGINES = ['loop', 'array', 'auto']
+
+
+def run_qs(engine, servers_nb, queue_size, seed, test_size=60):
+    rng = np.random.default_rng(seed)
+    arval_dist = lambda size=None: rng.exponential(1., size=size)
+    srv_dist = lambda size=None: rng.exponential(1.2 * servers_nb, size=size)
+    simulation = QS(arval_dist, srv_dist, servers_nb, queue_size, test_size=test_size, engine=engine)
+    simulation.pretreat()
+    simulation.run()
+    return simulation
+
+
+@pytest.mark.parametrize('engine', ENGINES)
+@pytest.mark.parametrize('servers_nb, queue_size, seed', list(BASELINE_BLOCKED))
+def test_blocked_matches_baseline(engine, servers_nb, queue_size, seed):
+    tops = run_qs(engine, servers_nb, queue_size, seed).tops
+
+    blocked = np.flatnonzero(tops['blocked'].to_numpy())
+    np.testing.assert_array_equal(blocked, BASELINE_BLOCKED[(servers_nb, queue_size, seed)])
+
+
+@pytest.mark.parametrize('engine', ENGINES)
+@pytest.mark.parametrize('servers_nb, queue_size, seed', list(BASELINE_DEPARTURES))
+def test_departures_match_baseline(engine, servers_nb, queue_size, seed):
+    tops = run_qs(engine, servers_nb, queue_size, seed).tops
+    expected = BASELINE_DEPARTURES[(servers_nb, queue_size, seed)]
+
+    departures = tops['t_depart_sys'].to_numpy()[list(expected)]
+    np.testing.assert_allclose(departures, list(expected.values()), rtol=0, atol=1e-9)
+
+
+@pytest.mark.parametrize('seed', [0, 1, 42])
+def test_engines_block_the_same_agents(seed):
+    blocked = [run_qs(engine, 2, 3, seed, test_size=500).tops['blocked'].to_numpy() for engine in ENGINES]
+
+    np.testing.assert_array_equal(blocked[0], blocked[1])
+    np.testing.assert_array_equal(blocked[0], blocked[2])
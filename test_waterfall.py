@@ -0,0 +1,41 @@
+import numpy as np
+
+from arrivals import PiecewiseRate
+from waterfall import Waterfall
+
+
+def peak_table():
+    #Off-peak at 0.2 then peak at 3 arrivals per unit of time, every 100 units
+    return PiecewiseRate([0, 50], [0.2, 3.], period=100)
+
+
+def off_peak_share(t_arvals):
+    #Expected share of arrivals in the off-peak half of the period: 0.2 * 50 / (0.2 * 50 + 3 * 50)
+    return (t_arvals % 100 < 50).mean()
+
+
+def test_tandem_after_run_follows_rate_table():
+    simulation = Waterfall(peak_table(), 1., 5., 4, size=1000)
+    simulation.run()
+    tandem = simulation.tandem()
+
+    #Arrival times of the network, recorded as they are drawn
+    draws = []
+    a_dist = tandem.arval_dist
+    tandem.arval_dist = lambda size: draws.append(a_dist(size=size)) or draws[-1]
+    tandem.run(20000)
+    t_arvals = np.cumsum(np.concatenate(draws))
+
+    assert abs(off_peak_share(t_arvals) - 0.0625) < 0.01
+
+
+def test_second_run_restarts_rate_table():
+    simulation = Waterfall(peak_table(), 1., 5., 4, size=5000)
+    simulation.run()
+    first = simulation.q_test.tops['t_arval_queue'].to_numpy().copy()
+    simulation.run()
+    second = simulation.q_test.tops['t_arval_queue'].to_numpy()
+
+    assert abs(off_peak_share(first) - 0.0625) < 0.02
+    assert abs(off_peak_share(second) - 0.0625) < 0.02
+    assert second[-1] < 1.5 * first[-1]
@@ -0,0 +1,206 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+
+AGENT_COLUMNS = {'agent': np.int64, 't_arval_queue': np.float64, 't_arval_srv': np.float64,
+                 't_depart_sys': np.float64, 'blocked': np.bool_, 'server': np.int32}
+PROCESS_COLUMNS = {'t': np.float64, 'in_queue': np.int64, 'in_service': np.int64}
+
+
+def occupancy_events(t_arval_queue, t_arval_srv, t_depart_sys):
+    """
+    Processus d'occupation exact à partir des temps des agents servis : nombre d'agents en file
+    et en service après chaque évènement, les départs d'un instant passant avant les arrivées.
+    """
+    n = len(t_arval_queue)
+    t = np.concatenate((t_depart_sys, t_arval_srv, t_arval_queue))
+    queue_steps = np.concatenate((np.zeros(n, np.int64), -np.ones(n, np.int64), np.ones(n, np.int64)))
+    service_steps = np.concatenate((-np.ones(n, np.int64), np.ones(n, np.int64), np.zeros(n, np.int64)))
+    order = np.argsort(t, kind='stable')
+    return t[order], np.cumsum(queue_steps[order]), np.cumsum(service_steps[order])
+
+
+class TraceWriter():
+    """
+    Ecriture d'une trace sur disque au fil de la simulation, un dossier par paquet et un fichier
+    .npy par colonne : agents/000000/t_arval_queue.npy, process/000000/t.npy, ...
+
+    meta.json n'est réécrit que par commit, la trace est lisible jusqu'au dernier commit. Il
+    compte aussi les arrivées, agents encore en file à la fin compris.
+    """
+
+    def __init__(self, path, srv_z, queue_z):
+        self.path = path
+        self.meta = {'srv_z': srv_z, 'queue_z': queue_z, 'arrivals': 0,
+                     'agents': {'chunks': 0, 'rows': 0}, 'process': {'chunks': 0, 'rows': 0}}
+        for kind in ('agents', 'process'):
+            os.makedirs(os.path.join(path, kind), exist_ok=True)
+
+    def write(self, kind, columns):
+        rows = len(next(iter(columns.values())))
+        if not rows:
+            return
+        dtypes = AGENT_COLUMNS if kind == 'agents' else PROCESS_COLUMNS
+        chunk = os.path.join(self.path, kind, f"{self.meta[kind]['chunks']:06d}")
+        os.makedirs(chunk, exist_ok=True)
+        for name, dtype in dtypes.items():
+            np.save(os.path.join(chunk, f'{name}.npy'), np.asarray(columns[name], dtype=dtype))
+        self.meta[kind]['chunks'] += 1
+        self.meta[kind]['rows'] += rows
+
+    def write_agents(self, columns):
+        self.write('agents', columns)
+
+    def add_arrivals(self, nb_agents):
+        self.meta['arrivals'] += int(nb_agents)
+
+    def write_process(self, t, in_queue, in_service):
+        self.write('process', {'t': t, 'in_queue': in_queue, 'in_service': in_service})
+
+    def write_tops(self, tops, agents=None, chunk_size=10**6):
+        """
+        Ecrit des agents au format de QS.tops et leur processus d'occupation, par paquets.
+        """
+        agents = np.arange(len(tops)) if agents is None else agents
+        self.add_arrivals(len(tops))
+        for start in range(0, len(tops), chunk_size):
+            chunk = tops.iloc[start:start + chunk_size]
+            self.write_agents({'agent': agents[start:start + chunk_size], **{name: chunk[name].to_numpy()
+                               for name in AGENT_COLUMNS if name != 'agent'}})
+
+        served = ~tops['blocked'].to_numpy()
+        t, in_queue, in_service = occupancy_events(*(tops[name].to_numpy()[served]
+                                                     for name in ['t_arval_queue', 't_arval_srv', 't_depart_sys']))
+        for start in range(0, len(t), chunk_size):
+            self.write_process(t[start:start + chunk_size], in_queue[start:start + chunk_size],
+                               in_service[start:start + chunk_size])
+
+    def commit(self):
+        with open(os.path.join(self.path, 'meta.json'), 'w') as f:
+            json.dump(self.meta, f)
+
+
+class Trace():
+    """
+    Lecture paresseuse d'une trace écrite par TraceWriter : les colonnes sont ouvertes en
+    mémoire partagée (mmap) paquet par paquet, sans tout charger.
+
+    Expose srv_z, queue_z, t_end, timeline et occupancy comme QS, pour les statistiques et les
+    animations.
+
+    Une trace de streaming n'a dans ses colonnes d'agents que les agents servis ou bloqués : ceux
+    encore en file à la fin n'y sont pas, mais comptent dans arrivals.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'meta.json')) as f:
+            self.meta = json.load(f)
+        self.srv_z = self.meta['srv_z']
+        self.queue_z = self.meta['queue_z']
+        self.test_z = self.meta['agents']['rows']
+        self.arrivals = self.meta.get('arrivals', self.test_z)
+
+        # Début de chaque paquet du processus, pour l'échantillonner sans tout parcourir
+        self.starts = np.array([chunk['t'][0] for chunk in self.chunks('process', ['t'])])
+        self.t_end = float(self.column('t', 'process', chunk=-1)[-1]) if len(self.starts) else 0.
+
+    def chunks(self, kind='agents', columns=None):
+        columns = columns or list(AGENT_COLUMNS if kind == 'agents' else PROCESS_COLUMNS)
+        for k in range(self.meta[kind]['chunks']):
+            yield self.chunk(kind, k, columns)
+
+    def chunk(self, kind, k, columns):
+        chunk = os.path.join(self.path, kind, f'{k:06d}')
+        return {name: np.load(os.path.join(chunk, f'{name}.npy'), mmap_mode='r') for name in columns}
+
+    def column(self, name, kind='agents', chunk=None):
+        """
+        Une colonne entière chargée en mémoire, ou celle d'un seul paquet.
+        """
+        if chunk is not None:
+            return self.chunk(kind, chunk % self.meta[kind]['chunks'], [name])[name]
+        return np.concatenate([chunk[name] for chunk in self.chunks(kind, [name])])
+
+    def tops(self):
+        """
+        Trace complète au format de QS.tops, indexée par numéro d'agent et chargée en mémoire.
+        """
+        columns = {name: self.column(name) for name in AGENT_COLUMNS}
+        agents = columns.pop('agent')
+        order = np.argsort(agents, kind='stable')
+        return pd.DataFrame({name: values[order] for name, values in columns.items()}, index=agents[order])
+
+    def occupancy(self, times):
+        """
+        Nombre d'agents en file et en service à chaque instant de times (croissants).
+        """
+        in_queue = np.zeros(len(times), dtype=np.int64)
+        in_service = np.zeros(len(times), dtype=np.int64)
+        bounds = np.searchsorted(times, self.starts, side='left').tolist() + [len(times)]
+        for k, chunk in enumerate(self.chunks('process')):
+            lo, hi = bounds[k], bounds[k + 1]
+            if lo == hi:
+                continue
+            ix = np.searchsorted(chunk['t'], times[lo:hi], side='right') - 1
+            in_queue[lo:hi] = chunk['in_queue'][ix]
+            in_service[lo:hi] = chunk['in_service'][ix]
+        return in_queue, in_service
+
+    def stats(self):
+        """
+        Statistiques de QS.timeline calculées paquet par paquet.
+        """
+        served = blocked = waited = 0
+        sojourn = waiting = service = 0.
+        for chunk in self.chunks('agents', ['blocked', 't_arval_queue', 't_arval_srv', 't_depart_sys']):
+            ok = ~chunk['blocked']
+            t_waiting = chunk['t_arval_srv'][ok] - chunk['t_arval_queue'][ok]
+            t_service = chunk['t_depart_sys'][ok] - chunk['t_arval_srv'][ok]
+            served += int(ok.sum())
+            blocked += len(ok) - int(ok.sum())
+            waited += int((t_waiting > 0).sum())
+            waiting += t_waiting.sum()
+            service += t_service.sum()
+            sojourn += (t_waiting + t_service).sum()
+
+        # Aires sous le processus, l'état d'un paquet vaut jusqu'au premier évènement du suivant
+        area_queue = area_service = time_full = 0.
+        for k, chunk in enumerate(self.chunks('process')):
+            t = np.append(chunk['t'], self.starts[k + 1] if k + 1 < len(self.starts) else self.t_end)
+            durations = np.diff(t)
+            area_queue += (durations * chunk['in_queue']).sum()
+            area_service += (durations * chunk['in_service']).sum()
+            time_full += durations[chunk['in_service'] >= self.srv_z].sum()
+
+        t_end = self.t_end
+        statnames = ['mean_sojourn_time', 'mean_waiting_time', 'mean_service_time',
+                     'waiting_proportion', 'blocked_proportion', 'servers_max_usage',
+                     'servers_usage', 'mean_queue_length', 'mean_agents_in_system']
+        stats = pd.DataFrame(np.empty((len(statnames), 1), dtype=object), index=statnames, columns=['run value'])
+
+        stats.loc['mean_sojourn_time'] = sojourn / served
+        stats.loc['mean_waiting_time'] = waiting / served
+        stats.loc['mean_service_time'] = service / served
+        stats.loc['waiting_proportion'] = waited / served
+        stats.loc['blocked_proportion'] = blocked / self.arrivals
+        stats.loc['servers_max_usage'] = time_full / t_end
+        stats.loc['servers_usage'] = area_service / (self.srv_z * t_end)
+        stats.loc['mean_queue_length'] = area_queue / t_end
+        stats.loc['mean_agents_in_system'] = (area_queue + area_service) / t_end
+
+        return stats
+
+    def timeline(self, t_delation=2, max_points=10**6):
+        """
+        Processus échantillonné sur une grille régulière et statistiques, comme QS.timeline. La
+        grille a t_delation points par agent, dans la limite de max_points.
+        """
+        t_range = np.linspace(0., self.t_end, min(t_delation * self.test_z, max_points))
+        in_queue, in_service = self.occupancy(t_range)
+        process = pd.DataFrame({'ag_in_sys': in_queue + in_service, 'ag_in_queue': in_queue,
+                                'ag_in_service': in_service}, index=t_range)
+        return process, self.stats()
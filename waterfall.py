@@ -1,12 +1,18 @@
+import copy
+
 import numpy as np
 import pandas as pd
-from qs import QS
+import analytic
+from arrivals import Arrivals
+from instrument import disabled
+from qs import QS, fifo
+from tandem import Stage, Tandem
 
 class Waterfall:
 
-    def __init__(self, lambda_a, lambda_t, lambda_d, nb_servers_test, nb_servers_front=1, q_test_size=None, q_front_size=None, size=100):
+    def __init__(self, lambda_a, lambda_t, lambda_d, nb_servers_test, nb_servers_front=1, q_test_size=None, q_front_size=None, size=100, seed=42, probe=None):
 
-        rng = np.random.default_rng(seed=42)
+        rng = np.random.default_rng(seed=seed)
 
         self.lambda_a = lambda_a
         self.lambda_t = lambda_t
@@ -15,32 +21,48 @@ class Waterfall:
         self.nb_servers_test = nb_servers_test
         self.nb_servers_front = nb_servers_front
 
-        self.a_dist = lambda size : rng.exponential(1./lambda_a, size=size)
-        self.t_dist = lambda : rng.exponential(1./lambda_t)
-        self.d_dist = lambda : rng.exponential(1./lambda_d)
+        # lambda_a est un taux, ou des arrivées non homogènes tirées avec le générateur de la simulation
+        if isinstance(lambda_a, Arrivals):
+            self.a_dist = copy.copy(lambda_a)
+            self.a_dist.rng = rng
+            self.a_dist.reset()
+        else:
+            self.a_dist = lambda size : rng.exponential(1./lambda_a, size=size)
+        self.t_dist = lambda size=None : rng.exponential(1./lambda_t, size=size)
+        self.d_dist = lambda size=None : rng.exponential(1./lambda_d, size=size)
 
         self.q_test_size = q_test_size
         self.q_front_size = q_front_size
 
         self.test_z = size
 
-        self.q_test = QS(self.a_dist, self.t_dist, nb_servers_test, q_test_size, policy = lambda x: 0, test_size=size)
-        self.q_front = QS(self.t_dist, self.d_dist, nb_servers_front, q_front_size, policy = lambda x: 0, test_size=size)
+        # Chaque queue mesure sous son propre préfixe dans la sonde commune
+        self.probe = probe or disabled
+
+        self.q_test = QS(self.a_dist, self.t_dist, nb_servers_test, q_test_size, policy = fifo, test_size=size,
+                         probe=self.probe.scope('test'))
+        self.q_front = QS(self.t_dist, self.d_dist, nb_servers_front, q_front_size, policy = fifo, test_size=size,
+                          probe=self.probe.scope('front'))
 
     def run(self):
         
-        # Pretreat to generate arrivals
-        self.q_test.pretreat()
+        with self.probe.phase('run'):
+            # Pretreat to generate arrivals
+            self.q_test.pretreat()
 
-        # Simule la file de tests
-        self.q_test.run()
+            # Simule la file de tests
+            self.q_test.run()
 
-        # Transfert des départs du système de test comme arrivées pour le front
-        valid_departures = self.q_test.tops[self.q_test.tops['t_depart_sys'] != -1]
-        self.q_front.tops.loc[:, 't_arval_queue'] = valid_departures['t_depart_sys'].values
+            # Transfert des départs du système de test comme arrivées pour le front
+            with self.probe.phase('transfer'):
+                valid_departures = self.q_test.tops[~self.q_test.tops['blocked']]
+                # Les agents bloqués par la file de tests n'arrivent jamais au front
+                self.q_front.test_z = len(valid_departures)
+                self.q_front.tops = self.q_front.tops.iloc[:self.q_front.test_z].copy()
+                self.q_front.tops['t_arval_queue'] = valid_departures['t_depart_sys'].values
 
-        # Simule la file de front
-        self.q_front.run()
+            # Simule la file de front
+            self.q_front.run()
 
     def posttreat(self):
         """
@@ -74,4 +96,27 @@ class Waterfall:
             'Sum Process': sum_process,
             'Test Stats': stats_test,
             'Front Stats': stats_front
-        }
\ No newline at end of file
+        }
+
+    def theory(self):
+        """
+        Statistiques stationnaires des deux queues (voir analytic.waterfall), avec les noms de timeline.
+        Il n'y en a pas pour des arrivées non homogènes.
+        """
+        return analytic.waterfall(self.lambda_a, self.lambda_t, self.lambda_d, self.nb_servers_test,
+                                  self.nb_servers_front, self.q_test_size, self.q_front_size)
+
+    def tandem(self, chunk_size=10000):
+        """
+        Réseau en tandem équivalent (tests puis front), simulé en une passe avec un seul calendrier.
+        """
+        stages = [
+            Stage(self.t_dist, self.nb_servers_test, self.q_test_size, name='Test Queue'),
+            Stage(self.d_dist, self.nb_servers_front, self.q_front_size, name='Front Queue')
+        ]
+        # Des arrivées non homogènes repartent de t=0 avec le réseau, quel que soit l'usage précédent
+        a_dist = self.a_dist
+        if isinstance(a_dist, Arrivals):
+            a_dist = copy.copy(a_dist)
+            a_dist.reset()
+        return Tandem(a_dist, stages, chunk_size=chunk_size)
\ No newline at end of file